@@ -0,0 +1,241 @@
+import argparse
+import collections
+import functools
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import engine
+import forecast
+import refresher
+import report
+import sheets
+import snapshot
+import sources
+
+# Tables used by the API, and those of each fiscal year
+table_names = ['calendar', 'employees', 'targets']
+year_table_names = ['monthly', 'groups']
+
+lock = threading.Lock()
+state = {'refresher': None}
+
+responses = collections.OrderedDict()
+max_responses = 256
+
+
+def load_refresher(sync=True):
+    # The background refresher keeping the snapshot tables loaded, started on
+    # first use. Without sync it only picks up snapshots written elsewhere
+    with lock:
+        if state['refresher'] is None:
+            sync_snapshot = None
+            if sync:
+                sync_snapshot = functools.partial(sources.sync_snapshot,
+                                                  sources.open_source())
+            state['refresher'] = refresher.Refresher(sync_snapshot).start()
+        return state['refresher']
+
+
+def current_tables(sync=True, year=None):
+    # The loaded tables for the fiscal `year` (the latest by default) along
+    # with the stamps they were written at (the data version). None if
+    # there's no such year
+    data = load_refresher(sync).current()
+    years = snapshot.partitions(data.stamps, 'monthly')
+    year = year or years[-1]
+    if year not in years:
+        return None, None
+    data = load_refresher(sync).load_year(year)
+    year_tables = {name: snapshot.partition_name(name, year)
+                   for name in year_table_names}
+    names = table_names + list(year_tables.values())
+
+    tables = {name: data.tables[name] for name in table_names}
+    tables['calendar'] = data.calendar
+    tables['monthly'] = data.tables[year_tables['monthly']]
+    tables['user_index'] = data.user_indexes[year_tables['monthly']]
+    tables['groups'] = data.tables[year_tables['groups']]
+    tables['targets'] = sheets.year_targets(tables['targets'], year)
+    tables['year'] = year
+    tables['years'] = years
+    version = (year,) + tuple(data.stamps[name] for name in names)
+    return tables, version
+
+
+def to_json(value):
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    return value
+
+
+def users_json(tables):
+    # Only people with hours in the year, since /utilization has nothing
+    # for anyone else
+    monthly = tables['monthly']
+    active = set(monthly.loc[monthly['Last Day'].notna(), 'User Name'])
+    names = [name for name in tables['employees']['User Name'].unique()
+             if name in active]
+    return json.dumps({'users': names}).encode('utf-8')
+
+
+def years_json(tables):
+    return json.dumps({'years': tables['years']}).encode('utf-8')
+
+
+def groups_json(tables):
+    groups = tables['groups'].drop_duplicates(['Dimension', 'Group'])
+    body = {dimension: list(rows['Group'])
+            for dimension, rows in groups.groupby('Dimension', sort=False)}
+    return json.dumps({'groups': body}).encode('utf-8')
+
+
+def utilization_json(tables, users, method, by_semester, group=None,
+                     rate=None):
+    if group:
+        utilization = report.build_group_utilization(
+            *group, tables['groups'], tables['calendar'], method,
+            provided_utilization=rate, by_semester=by_semester)
+    else:
+        utilization = report.build_utilization(
+            list(users), tables['monthly'], tables['calendar'], method,
+            provided_utilization=rate, by_semester=by_semester,
+            user_index=tables['user_index'], targets=tables['targets'])
+
+    table = utilization.table
+    body = {
+        'users': list(users),
+        'group': dict(zip(['dimension', 'group'], group)) if group else None,
+        'fiscal_year': tables['year'],
+        'method': method,
+        'by_semester': by_semester,
+        'this_month': utilization.this_month,
+        'valid_through': utilization.last_day_worked.strftime('%Y-%m-%d'),
+        'predicted_utilization': to_json(table.loc['Mar', 'Predicted Utilization']),
+        'months': [dict({'month': month},
+                        **{col: to_json(value) for col, value in row.items()})
+                   for month, row in table.iterrows()],
+    }
+    return json.dumps(body).encode('utf-8')
+
+
+def cached_response(key, build):
+    # Responses keyed by query and data version, least recently used evicted
+    with lock:
+        if key in responses:
+            responses.move_to_end(key)
+            return responses[key]
+    body = build()
+    with lock:
+        responses[key] = body
+        while len(responses) > max_responses:
+            responses.popitem(last=False)
+    return body
+
+
+class Handler(BaseHTTPRequestHandler):
+    sync = True
+
+    def send_json(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, json.dumps({'error': message}).encode('utf-8'))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            year = int(query.get('year', [0])[0])
+        except ValueError:
+            return self.send_error_json(400, "'year' must be a fiscal year, like 2021")
+        tables, version = current_tables(self.sync, year)
+        if tables is None:
+            return self.send_error_json(404, f"No hours for fiscal year {year}")
+
+        if url.path == '/users':
+            key = ('users', version)
+            build = functools.partial(users_json, tables)
+        elif url.path == '/years':
+            key = ('years', version)
+            build = functools.partial(years_json, tables)
+        elif url.path == '/groups':
+            key = ('groups', version)
+            build = functools.partial(groups_json, tables)
+        elif url.path == '/utilization':
+            users = tuple(dict.fromkeys(query.get('user', [])))
+            group = None
+            if 'group' in query:
+                group = (query.get('dimension', [engine.company])[0],
+                         query['group'][0])
+            method = query.get('method', ["Year (Semester) to Date"])[0]
+            by_semester = query.get('semester', ['0'])[0].lower() in ('1', 'true', 'yes')
+            try:
+                rate = float(query['rate'][0]) if 'rate' in query else None
+            except ValueError:
+                return self.send_error_json(400, "'rate' must be a utilization (%)")
+
+            if not users and not group:
+                return self.send_error_json(400, "Give at least one 'user' or a 'group'")
+            if users and group:
+                return self.send_error_json(400, "Give either 'user' or 'group', not both")
+            if method not in forecast.methods:
+                return self.send_error_json(400, f"'method' must be one of {forecast.methods}")
+            if method == 'Provided Rate' and rate is None:
+                return self.send_error_json(400, "'Provided Rate' needs a 'rate' (%)")
+            if group:
+                groups = tables['groups']
+                if not ((groups['Dimension'] == group[0])
+                        & (groups['Group'] == group[1])).any():
+                    return self.send_error_json(404, f"No group {group[1]!r} in {group[0]!r}")
+            else:
+                monthly = engine.user_rows(tables['monthly'], users,
+                                           tables['user_index'])
+                known = set(monthly.loc[monthly['Last Day'].notna(), 'User Name'])
+                unknown = [user for user in users if user not in known]
+                if unknown:
+                    return self.send_error_json(404, f"No hours for {unknown}")
+
+            key = (users, group, method, by_semester, rate, version)
+            build = functools.partial(utilization_json, tables, users, method,
+                                      by_semester, group, rate)
+        else:
+            return self.send_error_json(404, 'Not found')
+
+        # ETags change whenever the data is refreshed, so pollers can send
+        # If-None-Match and get an empty 304 without anything being computed
+        etag = '"' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '"'
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_json(200, cached_response(key, build), etag)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve utilization reports as JSON')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--no-sync', action='store_true',
+                        help='serve the local snapshot (picking up new ones) without '
+                             'checking the data source')
+    args = parser.parse_args()
+
+    Handler.sync = not args.no_sync
+    # Load the tables before taking requests
+    load_refresher(Handler.sync).current()
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print (f"Serving utilization API on {args.host}:{args.port}")
+    server.serve_forever()
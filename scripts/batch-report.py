@@ -0,0 +1,132 @@
+import argparse
+import concurrent.futures
+import datetime
+import os
+import re
+
+import pandas as pd
+
+import engine
+import forecast
+import report
+import sheets
+import snapshot
+import sources
+
+script_path = os.path.abspath(__file__)
+root_path = os.path.dirname(os.path.dirname(script_path))
+reports_path = os.path.join(root_path, 'reports')
+
+modes = ['Predictive', 'Classic']
+
+# Tables and options shared by every report, set once per worker process
+shared = {}
+
+
+def load_tables(sync=True, year=None):
+    # Tables for one fiscal year, the latest by default
+    if sync:
+        sources.sync_snapshot(sources.open_source())
+    year = year or snapshot.partitions(snapshot.stamps(), 'monthly')[-1]
+    tables = {name: snapshot.read_table(name)
+              for name in ['employees', 'targets']}
+    tables['dates'] = engine.Calendar.from_frame(snapshot.read_table('calendar'))
+    tables['monthly'] = snapshot.read_table(
+        snapshot.partition_name('monthly', year))
+    tables['targets'] = sheets.year_targets(tables['targets'], year)
+    return tables
+
+
+def init_worker(tables, options):
+    shared.update(tables)
+    shared['options'] = options
+
+
+def file_name(name):
+    return re.sub(r'[^\w\- ]', '', name).strip()
+
+
+def render_employee(name):
+    options = shared['options']
+    charts = {'User Name': name}
+
+    for mode in modes:
+        # Classic charts always use the year (semester) to date method, as in the app
+        method = options['method'] if mode == 'Predictive' else "Year (Semester) to Date"
+        utilization = report.build_utilization(
+            [name], shared['monthly'], shared['dates'], method,
+            provided_utilization=options['rate'],
+            by_semester=options['by_semester'], user_index=shared['user_index'],
+            targets=shared['targets'])
+        fig, _ = report.plot_hours(
+            utilization, options['target'], mode, shared['targets'])
+
+        path = os.path.join(options['output'], f'{file_name(name)} - {mode}.png')
+        fig.savefig(path, format='png', bbox_inches='tight', dpi=200)
+        charts[f'{mode} Chart'] = os.path.basename(path)
+
+    return charts
+
+
+def run(names, tables, options, workers=None):
+    os.makedirs(options['output'], exist_ok=True)
+    shared_tables = {name: tables[name] for name in ['dates', 'targets']}
+    shared_tables['monthly'], shared_tables['user_index'] = (
+        engine.index_users(tables['monthly']))
+
+    # Forecast the whole office in one pass; the workers only draw charts
+    forecasts = report.forecast_users(
+        names, shared_tables['monthly'], tables['dates'], options['method'],
+        options['rate'], options['by_semester'], shared_tables['user_index'],
+        tables['targets'])
+
+    # matplotlib rendering is CPU bound, so render in separate processes. The
+    # tables are sent to each worker once, not with every employee
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker,
+            initargs=(shared_tables, options)) as executor:
+        charts = list(executor.map(render_employee, names, chunksize=4))
+
+    summary = pd.DataFrame(charts).merge(forecasts, how='left')
+    summary.to_csv(os.path.join(options['output'], 'summary.csv'), index=False)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Render every employee's utilization charts and a summary CSV")
+    parser.add_argument('-o', '--output',
+                        default=os.path.join(reports_path,
+                                             datetime.date.today().isoformat()))
+    parser.add_argument('--method', default="Year (Semester) to Date",
+                        choices=forecast.methods)
+    parser.add_argument('--rate', type=float, default=None,
+                        help="utilization (%%) for the 'Provided Rate' method")
+    parser.add_argument('--by-semester', action='store_true')
+    parser.add_argument('--target', type=int, default=0,
+                        help='target utilization (%%) drawn on each chart')
+    parser.add_argument('--year', type=int, default=None,
+                        help='fiscal year, named for the year it ends (default: latest)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-sync', action='store_true',
+                        help='use the local snapshot without checking Google Sheets')
+    args = parser.parse_args()
+    if args.method == 'Provided Rate' and args.rate is None:
+        parser.error("--method 'Provided Rate' needs --rate")
+
+    tables = load_tables(sync=not args.no_sync, year=args.year)
+
+    # Everyone on the NAMES sheet with hours this fiscal year
+    monthly = tables['monthly']
+    active = set(monthly.loc[monthly['Last Day'].notna(), 'User Name'])
+    names = [name for name in tables['employees']['User Name'].unique()
+             if name in active]
+
+    options = {'output': args.output,
+               'method': args.method,
+               'by_semester': args.by_semester,
+               'rate': args.rate,
+               'target': args.target}
+    summary = run(names, tables, options, args.workers)
+
+    print (f"{len(summary)} reports written to {args.output}")
@@ -0,0 +1,205 @@
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+import engine
+import report
+import sheets
+import snapshot
+
+script_path = os.path.abspath(__file__)
+root_path = os.path.dirname(os.path.dirname(script_path))
+results_path = os.path.join(root_path, 'data', 'benchmarks.csv')
+
+projects = [f'Project {i:03d}' for i in range(40)]
+activities = pd.DataFrame(
+    [[name, 'Billable'] for name in projects]
+    + [['Internal R&D', 'R&D'], ['Proposal', 'Other'], ['Admin', 'Other'],
+       ['Vacation', 'Time Off'], ['Sick', 'Time Off'], ['Holiday', 'Time Off']],
+    columns=['Activity Name', 'Classification'])
+
+
+def synthetic_tables(n_staff, n_years=1, start_year=2019, seed=0):
+    """Generate raw worksheet tables shaped like the Google Sheets inputs.
+
+    Values are strings, as returned by get_all_values. Roughly a fifth of the
+    staff start partway through the period so the FTE proration is exercised.
+    """
+    rng = np.random.default_rng(seed)
+
+    days = pd.bdate_range(datetime.date(start_year, 4, 1),
+                          datetime.date(start_year + n_years, 3, 31))
+    dates = pd.DataFrame({'Date': days})
+    dates['Remaining'] = (dates.groupby(days.strftime('%Y-%m'))
+                          .cumcount(ascending=False) + 1)
+
+    names = np.array([f'Staff {i:04d}' for i in range(n_staff)])
+    start = np.where(rng.random(n_staff) < 0.2,
+                     rng.integers(0, len(days), n_staff), 0)
+
+    # One to three entries per person per working day from their start date
+    person, day = np.nonzero(np.arange(len(days))[None, :] >= start[:, None])
+    per_day = rng.integers(1, 4, len(person))
+    rows = np.repeat(np.column_stack([person, day]), per_day, axis=0)
+
+    activity = rng.choice(len(activities) - 1, len(rows),
+                          p=activity_weights(len(activities) - 1))
+    is_time_off = activities['Classification'].to_numpy()[activity] == 'Time Off'
+    hours = np.round(8 / np.repeat(per_day, per_day), 2)
+    activity_names = activities['Activity Name'].to_numpy()[activity]
+
+    hours_report = pd.DataFrame({
+        'User Name': names[rows[:, 0]],
+        'Entry Date': days[rows[:, 1]].strftime('%m/%d/%Y'),
+        # Activity names come from Replicon with trailing whitespace
+        'Activity Name': np.where(is_time_off, '', activity_names + ' '),
+        'Hours Worked': np.where(is_time_off, 0, hours).astype(str),
+        'Time Off Hrs': np.where(is_time_off, hours, 0).astype(str),
+        'Time Off Type': np.where(is_time_off, activity_names, ''),
+    })
+
+    dates['Date'] = days.strftime('%m/%d/%Y')
+    dates['Remaining'] = dates['Remaining'].astype(str)
+
+    employees = pd.DataFrame({'User Name': names})
+    targets = pd.DataFrame(
+        np.round(rng.uniform(0.5, 0.9, (n_staff, 12)), 2).astype(str),
+        columns=engine.list_months)
+    targets.insert(0, 'User Name', names)
+
+    return {'hours': hours_report,
+            'activities': activities.copy(),
+            'dates': dates,
+            'employees': employees,
+            'targets': targets}
+
+
+def activity_weights(n):
+    # Mostly billable work, some internal time and a little time off
+    weights = np.ones(n)
+    weights[:len(projects)] = 2
+    return weights / weights.sum()
+
+
+def timed(func, repeat):
+    # Best of `repeat` runs, and the last result
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def prepare(raw):
+    # The post-processing auth_gspread used to do after get_all_values
+    dates = sheets.prepare_dates(raw['dates'].copy())
+    return {'hours': sheets.prepare_hours(raw['hours'].copy()),
+            'activities': raw['activities'],
+            'dates': dates,
+            'months': sheets.build_months(dates),
+            'employees': raw['employees'],
+            'targets': sheets.prepare_targets(raw['targets'].copy())}
+
+
+def render(utilization, mode, targets):
+    fig, _ = report.plot_hours(utilization, 70, mode, targets)
+    fig.savefig(io.BytesIO(), format='png', bbox_inches='tight', dpi=200)
+
+
+def run_stages(n_staff, n_years, repeat=3, seed=0):
+    raw = synthetic_tables(n_staff, n_years, seed=seed)
+    rows = len(raw['hours'])
+    results = []
+
+    def record(stage, func):
+        seconds, result = timed(func, repeat)
+        results.append({'stage': stage, 'staff': n_staff, 'years': n_years,
+                        'rows': rows, 'seconds': round(seconds, 6)})
+        return result
+
+    tables = record('prepare tables', lambda: prepare(raw))
+    monthly = record('build monthly', lambda: engine.build_monthly(
+        tables['hours'], tables['activities'], tables['dates'], tables['months']))
+
+    # Reports read one fiscal year's partition: use the latest
+    partitions = sheets.split_years('monthly', monthly)
+    monthly = partitions[snapshot.partition_name(
+        'monthly', snapshot.partitions(partitions, 'monthly')[-1])]
+    monthly, user_index = record('index users', lambda: engine.index_users(monthly))
+
+    names = list(tables['employees']['User Name'])
+    for label, selection in [('1 user', names[:1]),
+                             ('10 users', names[:10]),
+                             ('all staff', names)]:
+        utilization = record(
+            f'build utilization ({label})',
+            lambda: report.build_utilization(selection, monthly,
+                                             tables['dates'], "Month to Date",
+                                             user_index=user_index))
+
+    record('forecast users (all staff)',
+           lambda: report.forecast_users(names, monthly, tables['dates'],
+                                         user_index=user_index,
+                                         targets=tables['targets']))
+
+    utilization = report.build_utilization(names[:1], monthly, tables['dates'],
+                                           "Month to Date", user_index=user_index)
+    for mode in ['Predictive', 'Classic']:
+        record(f'plot hours ({mode})',
+               lambda: render(utilization, mode, tables['targets']))
+        record(f'chart spec ({mode})',
+               lambda: json.dumps(report.chart_spec(
+                   utilization, 70, mode, tables['targets'])[0]))
+
+    return results
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=root_path, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def write_results(results, path=results_path):
+    # Append so runs from different versions can be compared over time
+    columns = ['run', 'version', 'stage', 'staff', 'years', 'rows', 'seconds']
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time each stage of the report pipeline on synthetic data')
+    parser.add_argument('--staff', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=results_path)
+    args = parser.parse_args()
+
+    run = datetime.datetime.now().isoformat(timespec='seconds')
+    version = git_version()
+    for n_staff in args.staff:
+        for n_years in args.years:
+            results = run_stages(n_staff, n_years, args.repeat, args.seed)
+            for result in results:
+                result.update(run=run, version=version)
+                print (f"{n_staff:>5} staff {n_years} yr {result['rows']:>9} rows  "
+                       f"{result['stage']:<30} {result['seconds']:.4f}s")
+            write_results(results, args.output)
@@ -1,41 +1,185 @@
+import argparse
 import datetime
+import json
 import os
-import win32com.client
+
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+import engine
+import ingest
+import sheets
+import sources
+import validate
 
 script_path = os.path.abspath(__file__)
 root_path = os.path.dirname(os.path.dirname(script_path))
 folder_path = os.path.join(root_path, 'data')
-today = datetime.date.today()
 
-outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
-inbox = outlook.GetDefaultFolder(6) 
-messages = inbox.Items
+report_path = ingest.report_path
+
+# Copy of the hours as last uploaded, in the same row order as the sheet
+state_path = os.path.join(folder_path, 'hours_uploaded.csv')
+state_meta_path = os.path.join(folder_path, 'hours_uploaded.json')
+
+
+def read_report(path):
+    report = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return sheets.normalize_hours(report)
+
+
+def read_clean_report(path, inputs):
+    # The report less any rows that fail validation, which are set aside in
+    # the quarantine file. Every run checks the whole report again, so rows
+    # come back once their activity or fiscal year is added to the inputs
+    report = pd.read_csv(path, dtype=str, keep_default_na=False)
+    clean, quarantined, summary = validate.validate_hours(
+        report, inputs['activities'], inputs['dates'])
+    validate.write_quarantine(quarantined)
+    print (validate.describe(summary))
+    return sheets.normalize_hours(clean)
+
+
+def diff(old, new):
+    added = new.loc[~new.index.isin(old.index)]
+    removed = old.loc[~old.index.isin(new.index)]
+    common = new.loc[new.index.isin(old.index)]
+    changed = common.loc[(common != old.loc[common.index]).any(axis=1)]
+    return added, changed, removed
+
+
+def write_state(report, changes_id):
+    report.to_csv(state_path, index=False)
+    with open(state_meta_path, 'w') as f:
+        json.dump({'changes_id': changes_id}, f)
+
+
+def read_state():
+    try:
+        with open(state_meta_path) as f:
+            meta = json.load(f)
+        return read_report(state_path), meta['changes_id']
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+
+def upload_full(client, report):
+    # Replace the whole spreadsheet, then start a new CHANGES log
+    gfile = client.open(sheets.hours_title).id
+    data = report.to_csv(index=False).encode('utf-8')
+    client.import_csv(gfile, data)
+
+    spreadsheet = client.open_by_key(gfile)
+    changes = spreadsheet.add_worksheet(sheets.changes_title, rows=1,
+                                        cols=len(report.columns) + 1)
+    changes.append_row(['Change'] + list(report.columns))
+
+    write_state(report, changes.id)
+    print (f"Utilization Report uploaded at {datetime.datetime.now().strftime('%c')}")
+
+
+def upload_incremental(client, report, state, changes_id):
+    # Upsert only new and changed rows (and delete removed ones) in place,
+    # logging each change to the CHANGES worksheet for the app to merge.
+    # Returns False if the sheet doesn't match the saved state
+    spreadsheet = client.open(sheets.hours_title)
+    try:
+        changes = spreadsheet.worksheet(sheets.changes_title)
+    except gspread.WorksheetNotFound:
+        return False
+    if changes.id != changes_id or list(report.columns) != list(state.columns):
+        return False
+    wks = spreadsheet.sheet1
+
+    added, changed, removed = diff(state, report)
+
+    # Sheet rows follow the saved state, after the header row
+    if len(changed):
+        rows = state.index.get_indexer(changed.index) + 2
+        wks.batch_update(
+            [{'range': f'A{row}:{rowcol_to_a1(row, len(report.columns))}',
+              'values': [values]}
+             for row, values in zip(rows, changed.values.tolist())],
+            value_input_option='USER_ENTERED')
+
+    # Delete from the bottom up so earlier row numbers stay valid
+    if len(removed):
+        rows = sorted(state.index.get_indexer(removed.index) + 2, reverse=True)
+        spreadsheet.batch_update({'requests': [
+            {'deleteDimension': {'range': {'sheetId': wks.id,
+                                           'dimension': 'ROWS',
+                                           'startIndex': int(row) - 1,
+                                           'endIndex': int(row)}}}
+            for row in rows]})
+
+    if len(added):
+        wks.append_rows(added.values.tolist(),
+                        value_input_option='USER_ENTERED')
+
+    log = ([['upsert'] + values for values in changed.values.tolist()]
+           + [['upsert'] + values for values in added.values.tolist()]
+           + [['delete'] + values for values in removed.values.tolist()])
+    if log:
+        changes.append_rows(log, value_input_option='USER_ENTERED')
+
+    state = state.loc[~state.index.isin(removed.index)].copy()
+    state.loc[changed.index] = changed
+    state = pd.concat([state, added])
+    write_state(state, changes_id)
+
+    print (f"Utilization Report updated at {datetime.datetime.now().strftime('%c')}: "
+           f"{len(added)} added, {len(changed)} changed, {len(removed)} removed")
+    return True
+
+
+def publish_monthly(client, report, inputs):
+    # Materialize the per-user monthly fact table (hours by classification
+    # with FTE attached) so the app doesn't aggregate raw hours
+    hours = sheets.prepare_hours(report.reset_index(drop=True))
+    monthly = engine.build_monthly(hours, inputs['activities'],
+                                   inputs['dates'], inputs['months'])
+    sheets.write_monthly(client.open(sheets.hours_title), monthly)
+
+    print (f"Monthly table published: {len(monthly)} rows")
 
-for message in messages:
-    if (message.Subject == "Utilization Report from Replicon." 
-        and message.Senton.date() == today):
-        # body_content = message.body
-        attachments = message.Attachments
-        attachment = attachments.Item(1)
-        attachment.SaveAsFile(os.path.join(folder_path, str(attachment)))
 
-print (f"Utilization Report saved in {folder_path}")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Upload the daily Replicon report to Utilization-Hours')
+    parser.add_argument('--full', action='store_true',
+                        help='replace the whole sheet instead of uploading changes')
+    parser.add_argument('--mailbox', default=None,
+                        help="where the Replicon report arrives: 'dir:<folder>' "
+                             "(default data/inbox), 'mbox:<file>', "
+                             "'imap://<user>@<host>/<folder>' or 'outlook' "
+                             "(see ingest.py)")
+    parser.add_argument('--store', default=None,
+                        help="also write the hours and inputs to a local data "
+                             "source the app can read directly, e.g. 'sqlite' or "
+                             "'sqlite:<path>' (see sources.py)")
+    args = parser.parse_args()
 
-scope = ['https://spreadsheets.google.com/feeds',
-         'https://www.googleapis.com/auth/drive']
+    if ingest.save_report(ingest.open_mailbox(args.mailbox), report_path):
+        print (f"Utilization Report saved in {folder_path}")
+    else:
+        print ("No new Utilization Report, uploading the last one saved")
 
-creds = ServiceAccountCredentials.from_json_keyfile_name(
-            'secrets/gs_credentials.json', scope
-        )
-client = gspread.authorize(creds)
+    client = sheets.authorize()
+    frames = sheets.read_inputs(client.open(sheets.inputs_title))
+    inputs = sheets.input_tables({name: frame.copy()
+                                  for name, frame in frames.items()})
+    report = read_clean_report(report_path, inputs)
+    state, changes_id = read_state()
 
-gfile = client.open("Utilization-Hours").id  
-report_path = os.path.join(folder_path, "Utilization Report Daily.csv")
-data = open(report_path, 'r').read()
-data = data.encode('utf-8')
+    if args.store:
+        # The inputs as fetched too, so the store always has the current
+        # ones and classifies the hours against them
+        frames['hours'] = report.reset_index(drop=True)
+        sources.open_source(args.store).write_frames(frames)
 
-client.import_csv(gfile, data)
+    if (args.full or state is None
+            or not upload_incremental(client, report, state, changes_id)):
+        upload_full(client, report)
 
-print (f"Utilization Report uploaded at {datetime.datetime.now().strftime('%c')}")
+    publish_monthly(client, report, inputs)
@@ -0,0 +1,373 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Fiscal year runs April through March
+list_months = ['Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec',
+               'Jan', 'Feb', 'Mar']
+semester1 = list_months[:7]
+semester2 = list_months[7:]
+month_dict = dict(zip(list_months, np.arange(0, 12)))
+
+# Labor categories reported on the chart, in stacking order
+classifications = ['Billable', 'R&D', 'Other', 'Time Off']
+
+# Roll-up of everyone with hours, alongside the groups from the NAMES sheet.
+# Named so it doesn't take the place of a Company column there
+company = 'Whole Company'
+
+
+def fiscal_years(entry_dates):
+    # Fiscal year of each date, named for the calendar year it ends in
+    # (April 2020 through March 2021 is 2021)
+    days = pd.DatetimeIndex(entry_dates)
+    return pd.array(days.year + (days.month >= 4), dtype='Int16')
+
+
+def fiscal_months(entry_dates):
+    # Month of each date as an ordered categorical of list_months, so the
+    # int8 codes are the fiscal month index (April is 0)
+    month = pd.DatetimeIndex(entry_dates).month.to_numpy()
+    codes = np.where(np.isnan(month), -1, (month - 4) % 12).astype('int8')
+    return pd.Categorical.from_codes(codes, list_months, ordered=True)
+
+
+def classify(hours_report, activities):
+    # Map every entry to its classification, looking up each distinct
+    # activity once. Set any activity not in the Activity sheet to 'Billable'
+    lookup = (activities.drop_duplicates('Activity Name')
+              .set_index('Activity Name')['Classification'])
+    activity = pd.Categorical(hours_report['Activity Name'])
+    classes = lookup.reindex(activity.categories).fillna('Billable').to_numpy()
+    return pd.Series(classes[activity.codes], index=hours_report.index)
+
+
+class Calendar:
+    """Working days remaining in the month on every day of the DATES months.
+
+    One value per calendar day of every month in the DATES sheet, so a day
+    is looked up by its offset from the first instead of by searching the
+    DATES table. A day never takes another month's count: days missing from
+    the sheet (e.g. weekends) count the working days left after them in their
+    own month. to_frame() is the compact table the snapshot keeps.
+    """
+
+    def __init__(self, start, remaining, working):
+        self.start = pd.Timestamp(start).to_datetime64().astype('datetime64[ns]')
+        self.values = np.asarray(remaining, dtype=float)
+        self.working = np.asarray(working, dtype=bool)
+
+    @classmethod
+    def from_dates(cls, dates):
+        remaining = (dates.drop_duplicates('Date')
+                     .set_index('Date')['Remaining']
+                     .sort_index())
+        remaining = remaining.loc[remaining.index.notna()]
+        if remaining.empty:
+            return cls(None, [], [])
+        days = pd.date_range(remaining.index[0].to_period('M').start_time,
+                             remaining.index[-1].to_period('M').end_time.normalize(),
+                             freq='D')
+        remaining = remaining.reindex(days)
+        # Fill from the next working day in the same month; none left is 0
+        values = (remaining.groupby(days.to_period('M')).bfill()
+                  .fillna(0))
+        return cls(days[0], values, remaining.notna())
+
+    @classmethod
+    def from_frame(cls, frame):
+        if frame.empty:
+            return cls(None, [], [])
+        return cls(frame['Date'].iloc[0], frame['Remaining'], frame['Working'])
+
+    def to_frame(self):
+        return pd.DataFrame({
+            'Date': pd.date_range(self.start, periods=len(self.values), freq='D')
+                    if len(self.values) else pd.DatetimeIndex([]),
+            'Remaining': self.values,
+            'Working': self.working})
+
+    def offsets(self, days):
+        # Position of each day in the calendar; -1 (the NaN appended to a
+        # lookup) outside the DATES months
+        days = np.asarray(pd.DatetimeIndex(pd.to_datetime(days)).normalize(),
+                          dtype='datetime64[ns]')
+        offsets = (days - self.start) / np.timedelta64(1, 'D')
+        found = (offsets >= 0) & (offsets < len(self.values))
+        return np.where(found, offsets, -1).astype(int)
+
+    def remaining(self, days):
+        # Working days left in the month counting the day itself, NaN outside
+        # the DATES months
+        return np.append(self.values, np.nan)[self.offsets(days)]
+
+    def remaining_after(self, days):
+        # Working days left in the month after the day
+        return np.append(self.values - self.working, np.nan)[self.offsets(days)]
+
+
+def calendar(dates):
+    # `dates` is the DATES table or its Calendar, which saves building one
+    # per call
+    if isinstance(dates, Calendar):
+        return dates
+    return Calendar.from_dates(dates)
+
+
+def remaining_days(dates, days):
+    # Working days remaining in the month from each day (a first day worked)
+    days = pd.DatetimeIndex(pd.to_datetime(days))
+    return pd.Series(calendar(dates).remaining(days), index=days)
+
+
+def days_left(dates, days):
+    # Working days remaining in the month after each day (a last day worked)
+    days = pd.DatetimeIndex(pd.to_datetime(days))
+    return pd.Series(calendar(dates).remaining_after(days), index=days)
+
+
+def build_tables(names, hours_report, activities, dates, months,
+                 user_index=None):
+    """Build monthly hours and FTE for every user in `names` at once.
+
+    Returns the per-user table (indexed by User Name and Entry Month), the
+    aggregate table across users (indexed by Entry Month) and each user's
+    last day worked. `user_index` is the hours report's index_users() index,
+    if it has one.
+    """
+    names = list(dict.fromkeys(names))
+
+    # Subset once for the whole selection
+    df = user_rows(hours_report, names, user_index)[
+        ['User Name', 'Entry Date', 'Entry Month', 'Activity Name',
+         'Hours Worked']]
+    df = df.assign(Classification=classify(df, activities))
+
+    sums = (df.groupby(['User Name', 'Entry Month', 'Classification'],
+                       observed=True)
+            ['Hours Worked'].sum())
+    first_days = df.groupby('User Name', observed=True)['Entry Date'].min()
+    # Last day worked ignores holidays
+    worked = df.loc[~df['Activity Name'].isin(['Holiday'])]
+    last_days = worked.groupby('User Name', observed=True)['Entry Date'].max()
+
+    return summarize_tables(names, sums, first_days, last_days, dates, months)
+
+
+def summarize_tables(names, sums, first_days, last_days, dates, months):
+    """Build the tables of build_tables from hours already summed.
+
+    `sums` are the hours by User Name, Entry Month and Classification, and
+    `first_days` and `last_days` each user's first day and last day worked
+    (ignoring holidays), so the sums can come from anywhere, e.g. a database.
+    """
+    # Pivot monthly hours (user x month x classification), zero filling any
+    # month or category without hours
+    index = pd.MultiIndex.from_product([names, list_months],
+                                       names=['User Name', 'Entry Month'])
+    per_user = (sums
+                .unstack('Classification')
+                .reindex(index=index, columns=classifications)
+                .fillna(0)
+                .astype(float))
+    # Hours are entered to the hundredth but stored as float32, so round off
+    # the float32 error in the totals
+    per_user = per_user.round(2)
+    per_user.columns.name = None
+
+    # FTE per month, corrected for employees who start in the middle of the
+    # performance period: zero before the first month worked, prorated for
+    # the first month itself. Users without any hours carry no FTE.
+    first_days = first_days.reindex(names)
+    first_month = first_days.dt.strftime('%b').map(month_dict)
+    started = first_month.notna().to_numpy()
+    start = first_month.fillna(len(list_months)).to_numpy(dtype=int)
+
+    fte = np.tile(months['FTE'].reindex(list_months).to_numpy(dtype=float),
+                  (len(names), 1))
+    fte[np.arange(len(list_months)) < start[:, None]] = 0
+
+    first_fte = np.full(len(names), np.nan)
+    if started.any():
+        first_fte[started] = remaining_days(
+            dates, first_days[started]).to_numpy(dtype=float) * 8
+    prorate = started & ~np.isnan(first_fte)
+    fte[np.flatnonzero(prorate), start[prorate]] = first_fte[prorate]
+    per_user['FTE'] = fte.ravel()
+
+    # Last day worked, no later than today
+    last_days = (last_days.reindex(names)
+                 .clip(upper=pd.Timestamp(datetime.date.today())))
+
+    total = per_user.groupby(level='Entry Month').sum().reindex(list_months)
+
+    return per_user, total, last_days
+
+
+def build_monthly(hours_report, activities, dates, months):
+    """Build the monthly fact table for every user in the hours report.
+
+    One row per fiscal year, user and month with hours by classification, FTE
+    and the user's last day worked that year, so reports never need the raw
+    hours. `months` is indexed by Fiscal Year and Month.
+    """
+    partitions = []
+    for year, hours in hours_report.groupby('Fiscal Year', observed=True):
+        names = hours['User Name'].unique()
+        per_user, _, last_days = build_tables(names, hours, activities,
+                                              dates, year_months(months, year))
+        partitions.append(monthly_partition(year, per_user, last_days))
+    return concat_monthly(partitions)
+
+
+def summarize_monthly(sums, days, dates, months):
+    """Build the monthly fact table of build_monthly from hours already summed.
+
+    `sums` has the Hours Worked by Fiscal Year, User Name, Entry Month and
+    Classification, and `days` each user's First Day and Last Day worked
+    (ignoring holidays) by Fiscal Year.
+    """
+    keys = ['User Name', 'Entry Month', 'Classification']
+    partitions = []
+    for year, year_days in days.groupby('Fiscal Year', sort=True):
+        year_sums = (sums.loc[sums['Fiscal Year'] == year]
+                     .set_index(keys)['Hours Worked'])
+        year_days = year_days.set_index('User Name')
+        per_user, _, last_days = summarize_tables(
+            list(year_days.index), year_sums, year_days['First Day'],
+            year_days['Last Day'], dates, year_months(months, year))
+        partitions.append(monthly_partition(year, per_user, last_days))
+    return concat_monthly(partitions)
+
+
+def year_months(months, year):
+    # One fiscal year of build_months(), indexed by Month
+    return months.loc[
+        months.index.get_level_values('Fiscal Year') == year
+    ].droplevel('Fiscal Year')
+
+
+def monthly_partition(year, per_user, last_days):
+    monthly = per_user.reset_index()
+    monthly['Last Day'] = monthly['User Name'].map(last_days)
+    monthly.insert(0, 'Fiscal Year', year)
+    return monthly
+
+
+def concat_monthly(partitions):
+    if not partitions:
+        return pd.DataFrame(columns=['Fiscal Year', 'User Name', 'Entry Month']
+                            + classifications + ['FTE', 'Last Day'])
+    return pd.concat(partitions, ignore_index=True)
+
+
+def index_users(table):
+    """Sort `table` by User Name and find the rows of each user.
+
+    Returns the sorted table and a dict of User Name to the slice of its rows,
+    which user_rows() uses to pick out users without scanning the table.
+    """
+    table = table.sort_values('User Name', kind='stable', ignore_index=True)
+    users = table['User Name'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    stops = np.r_[starts[1:], len(users)]
+    return table, {users[start]: slice(start, stop)
+                   for start, stop in zip(starts, stops)}
+
+
+def user_rows(table, names, user_index=None):
+    # Rows of `table` for the users in `names`. With an index from
+    # index_users() this slices each user's rows (a view for a single user)
+    # instead of comparing every row's name
+    if user_index is None:
+        return table.loc[table['User Name'].isin(names)]
+    slices = [user_index[name] for name in names if name in user_index]
+    if len(slices) == 1:
+        return table.iloc[slices[0]]
+    if not slices:
+        return table.iloc[:0]
+    return pd.concat([table.iloc[rows] for rows in slices])
+
+
+def select_monthly(monthly, names, user_index=None):
+    # Same tables as build_tables, read from one fiscal year of the monthly
+    # fact table
+    names = list(dict.fromkeys(names))
+    index = pd.MultiIndex.from_product([names, list_months],
+                                       names=['User Name', 'Entry Month'])
+    per_user = (user_rows(monthly, names, user_index)
+                .set_index(['User Name', 'Entry Month']).reindex(index))
+
+    last_days = (per_user['Last Day'].groupby(level='User Name', sort=False)
+                 .max().reindex(names))
+    per_user = per_user[classifications + ['FTE']].fillna(0)
+
+    total = per_user.groupby(level='Entry Month').sum().reindex(list_months)
+
+    return per_user, total, last_days
+
+
+def group_dimensions(employees):
+    # Columns of the NAMES sheet besides User Name group people, e.g. Office
+    # or Practice
+    dimensions = [col for col in employees.columns if col != 'User Name']
+    if company in dimensions:
+        raise ValueError(f"NAMES can't have a {company!r} column: that's the "
+                         "roll-up of everyone with hours")
+    return dimensions
+
+
+def build_groups(monthly, employees, targets=None):
+    """Roll one fiscal year of the monthly fact table up to every group.
+
+    One row per dimension (each group column of the NAMES sheet, and the
+    whole company for everyone with hours), group and month, with the members' summed hours
+    and FTE, the billable hours their `targets` plan for (NaN unless every
+    member has a plan that month), and the latest and earliest of their last
+    days worked.
+    """
+    dimensions = group_dimensions(employees) + [company]
+    members = (pd.DataFrame({'User Name': monthly['User Name'].unique()})
+               .merge(employees.drop_duplicates('User Name'), how='left')
+               .assign(**{company: 'All'})
+               .melt(id_vars='User Name', value_vars=dimensions,
+                     var_name='Dimension', value_name='Group'))
+    # A blank cell leaves the person out of that dimension
+    members = members.loc[members['Group'].notna() & (members['Group'] != '')]
+
+    rows = monthly.merge(members, on='User Name')
+    if targets is not None:
+        plan = (targets.drop_duplicates('User Name')
+                .melt(id_vars='User Name', value_vars=list_months,
+                      var_name='Entry Month', value_name='Plan'))
+        rows = rows.merge(plan, how='left')
+        rows['Planned Hours'] = rows['Plan'] * rows['FTE']
+    else:
+        rows['Planned Hours'] = np.nan
+    rows['Unplanned'] = rows['Planned Hours'].isna()
+    keys = ['Dimension', 'Group']
+    index = (rows[keys].drop_duplicates()
+             .merge(pd.DataFrame({'Entry Month': list_months}), how='cross'))
+    sums = (rows.groupby(keys + ['Entry Month'], sort=False)
+            [classifications + ['FTE', 'Planned Hours', 'Unplanned']].sum()
+            .reset_index())
+    sums['Planned Hours'] = sums['Planned Hours'].mask(sums.pop('Unplanned') > 0)
+    days = (rows.groupby(keys, sort=False)['Last Day']
+            .agg(**{'Latest Day': 'max', 'Earliest Day': 'min'}).reset_index())
+
+    groups = index.merge(sums, how='left').merge(days, how='left')
+    groups[classifications + ['FTE']] = groups[classifications + ['FTE']].fillna(0)
+    return groups
+
+
+def select_group(groups, dimension, group):
+    # Aggregate table (indexed by Entry Month) and the latest and earliest
+    # last days worked of one group, read from build_groups()
+    rows = groups.loc[(groups['Dimension'] == dimension)
+                      & (groups['Group'] == group)]
+    total = (rows.set_index('Entry Month')[classifications + ['FTE', 'Planned Hours']]
+             .reindex(list_months)
+             .fillna({col: 0 for col in classifications + ['FTE']}))
+    last_days = pd.concat([rows['Latest Day'], rows['Earliest Day']])
+    return total, last_days
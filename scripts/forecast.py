@@ -0,0 +1,107 @@
+import collections
+
+import numpy as np
+
+from engine import list_months, semester1
+
+# Ways of predicting utilization for the rest of the year
+methods = ["Month to Date", "Last Month", "Year (Semester) to Date",
+           "Planned", "Provided Rate"]
+
+# Fiscal month index where the second semester starts
+semester_start = len(semester1)
+
+Forecast = collections.namedtuple(
+    'Forecast',
+    ['utilization', 'util_to_date', 'rates', 'predicted_hours',
+     'predicted_utilization'])
+
+
+def cumulative(values):
+    # Running total along the months, skipping NaN like pandas cumsum
+    totals = np.nancumsum(values, axis=1)
+    totals[np.isnan(values)] = np.nan
+    return totals
+
+
+def cumulative_utilization(hours, fte, by_semester=False):
+    # Utilization from the start of the year (or of the semester) to each month
+    utilization = cumulative(hours) / cumulative(fte)
+    if by_semester:
+        second = slice(semester_start, None)
+        utilization[:, second] = (cumulative(hours[:, second])
+                                  / cumulative(fte[:, second]))
+    return utilization
+
+
+def forecast(billable, fte, this_month, days_remaining, planned_hours=None,
+             provided=None, by_semester=False):
+    """Forecast the year's utilization with every method at once.
+
+    `billable` and `fte` are (entities x 12) arrays of hours in fiscal month
+    order, one row per person or selection. `this_month` is each row's
+    fiscal month index and `days_remaining` its working days left after the
+    last day worked. `planned_hours` (same shape, NaN where there's no plan)
+    are the billable hours the targets plan for, and `provided` a rate
+    (0-1) to hold from next month on; methods without them are left out.
+
+    Returns a Forecast with the monthly and month to date utilization, and
+    per method the rate used for each month and the predicted hours and
+    predicted (cumulative) utilization.
+    """
+    billable = np.asarray(billable, dtype=float)
+    fte = np.asarray(fte, dtype=float)
+    this_month = np.asarray(this_month)
+    days_remaining = np.asarray(days_remaining, dtype=float)
+    rows = np.arange(len(billable))
+    months = np.arange(len(list_months))
+    future = months > this_month[:, None]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        utilization = billable / fte
+
+        # This month's utilization so far, over the hours worked to date
+        util_to_date = utilization.copy()
+        current_fte = fte[rows, this_month]
+        util_to_date[rows, this_month] = (
+            billable[rows, this_month]
+            / (current_fte - days_remaining * 8) * current_fte / current_fte)
+        hours_to_date = util_to_date * fte
+
+        # Hours to date over FTE to date, from the start of the year or of
+        # the current semester
+        start = np.where(by_semester & (this_month >= semester_start),
+                         semester_start, 0)
+        to_date = ~future & (months >= start[:, None])
+        year_to_date = (np.nansum(np.where(to_date, hours_to_date, 0), axis=1)
+                        / np.nansum(np.where(to_date, fte, 0), axis=1))
+
+        last_month = np.where(
+            this_month > 0,
+            utilization[rows, np.maximum(this_month - 1, 0)],
+            util_to_date[rows, this_month])
+
+        rates = {
+            "Month to Date": util_to_date[rows, this_month],
+            "Last Month": last_month,
+            "Year (Semester) to Date": year_to_date,
+        }
+        rates = {method: np.repeat(rate[:, None], len(months), axis=1)
+                 for method, rate in rates.items()}
+        if planned_hours is not None:
+            # Months without a plan carry on at the year to date rate
+            planned = np.asarray(planned_hours, dtype=float) / fte
+            rates["Planned"] = np.where(np.isnan(planned),
+                                        rates["Year (Semester) to Date"],
+                                        planned)
+        if provided is not None:
+            rates["Provided Rate"] = np.full(fte.shape, float(provided))
+
+        predicted_hours = {method: np.where(future, rate * fte, hours_to_date)
+                           for method, rate in rates.items()}
+        predicted_utilization = {
+            method: cumulative_utilization(hours, fte, by_semester)
+            for method, hours in predicted_hours.items()}
+
+    return Forecast(utilization, util_to_date, rates, predicted_hours,
+                    predicted_utilization)
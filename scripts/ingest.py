@@ -0,0 +1,284 @@
+import argparse
+import datetime
+import email
+import email.policy
+import imaplib
+import json
+import mailbox
+import os
+import re
+import urllib.parse
+
+script_path = os.path.abspath(__file__)
+root_path = os.path.dirname(os.path.dirname(script_path))
+folder_path = os.path.join(root_path, 'data')
+
+report_path = os.path.join(folder_path, "Utilization Report Daily.csv")
+report_subject = "Utilization Report from Replicon."
+
+# Drop folder watched by default
+inbox_path = os.path.join(folder_path, 'inbox')
+
+# High-water mark of each mailbox: how far it has been read
+state_path = os.path.join(folder_path, 'ingest_state.json')
+
+
+def report_attachment(message):
+    # Contents of the report attached to a Replicon message, or None
+    if message['Subject'] != report_subject:
+        return None
+    for part in message.iter_attachments():
+        if part.get_filename():
+            return part.get_payload(decode=True)
+    return None
+
+
+def parse_message(data):
+    return email.message_from_bytes(data, policy=email.policy.default)
+
+
+class DropFolder:
+    """A folder the report is saved or forwarded into.
+
+    Takes report CSV files as they are, and the attachment of .eml messages.
+    The mark is the modified time and name of the last file read.
+    """
+
+    def __init__(self, path=inbox_path):
+        self.path = path
+        self.key = f'dir:{os.path.abspath(path)}'
+
+    def new_reports(self, mark):
+        # Yields each newer file's mark and report (None if it isn't one)
+        mark = tuple(mark or (0, ''))
+        os.makedirs(self.path, exist_ok=True)
+        files = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(('.csv', '.eml')):
+                    file_mark = (entry.stat().st_mtime_ns, entry.name)
+                    if file_mark > mark:
+                        files.append((file_mark, entry.path))
+
+        for file_mark, path in sorted(files):
+            with open(path, 'rb') as f:
+                data = f.read()
+            if path.endswith('.eml'):
+                data = report_attachment(parse_message(data))
+            yield list(file_mark), data
+
+
+class Mbox:
+    """An mbox file that mail is appended to.
+
+    The mark is the byte offset read up to, so only the messages appended
+    since are parsed, however long the file gets.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.key = f'mbox:{os.path.abspath(path)}'
+
+    def new_reports(self, mark):
+        offset = mark or 0
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < offset:
+                # The file was replaced or truncated: read it again
+                offset = 0
+            f.seek(offset)
+            data = f.read()
+
+        starts = [match.start() for match in re.finditer(rb'^From ', data, re.M)]
+        for start, end in zip(starts, starts[1:] + [len(data)]):
+            # Skip the From_ line that separates the messages
+            body = data[start:end].split(b'\n', 1)[-1]
+            attachment = report_attachment(parse_message(body))
+            if attachment is not None:
+                yield offset + end, attachment
+        # Nothing more to read up to the end of the file
+        yield offset + len(data), None
+
+
+class Imap:
+    """A folder on an IMAP server, searched for report messages.
+
+    The mark is the folder's UIDVALIDITY and the last UID read, so only
+    messages that arrived since are searched and fetched. `connect` returns
+    a logged in imaplib.IMAP4 (or a LocalImap).
+    """
+
+    def __init__(self, connect, folder='INBOX', key='imap'):
+        self.connect = connect
+        self.folder = folder
+        self.key = key
+
+    def new_reports(self, mark):
+        connection = self.connect()
+        try:
+            connection.select(self.folder, readonly=True)
+            _, [validity] = connection.response('UIDVALIDITY')
+            validity = int(validity)
+            last = mark[1] if mark and mark[0] == validity else 0
+
+            # UID ranges always include the newest message, so filter again
+            _, [found] = connection.uid('SEARCH', None, f'UID {last + 1}:*',
+                                        'SUBJECT', f'"{report_subject}"')
+            uids = sorted(uid for uid in map(int, found.split()) if uid > last)
+            for uid in uids:
+                _, data = connection.uid('FETCH', str(uid), '(RFC822)')
+                yield [validity, uid], report_attachment(parse_message(data[0][1]))
+        finally:
+            connection.logout()
+
+
+class LocalImap:
+    # Stand-in for a logged in imaplib.IMAP4 serving the messages of an mbox
+    # file, to try the IMAP ingester offline. UIDs are message numbers
+
+    def __init__(self, path, validity=1):
+        self.path = path
+        self.validity = validity
+        self.messages = []
+
+    def select(self, folder='INBOX', readonly=False):
+        self.messages = [message.as_bytes() for message in mailbox.mbox(self.path)]
+        return 'OK', [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        return code, [str(self.validity).encode()]
+
+    def uid(self, command, *args):
+        if command.upper() == 'SEARCH':
+            first = int(args[1].split()[1].split(':')[0])
+            subject = args[3].strip('"')
+            uids = [uid for uid, data in enumerate(self.messages, 1)
+                    if subject in (parse_message(data)['Subject'] or '')]
+            # Like a server, a range past the end still matches the newest
+            uids = [uid for uid in uids if uid >= first] or uids[-1:]
+            return 'OK', [' '.join(map(str, uids)).encode()]
+        if command.upper() == 'FETCH':
+            uid = int(args[0])
+            return 'OK', [(f'{uid} (RFC822)'.encode(), self.messages[uid - 1])]
+        raise ValueError(f'Unsupported command {command}')
+
+    def logout(self):
+        return 'BYE', []
+
+
+class Outlook:
+    """The Outlook inbox, on a Windows desktop.
+
+    The mark is when the last message read was received. Outlook filters
+    the inbox to newer messages rather than looping over every item.
+    """
+
+    key = 'outlook'
+
+    def new_reports(self, mark):
+        import win32com.client
+
+        outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
+        messages = outlook.GetDefaultFolder(6).Items
+        since = datetime.datetime.fromisoformat(mark) if mark else (
+            datetime.datetime.combine(datetime.date.today(), datetime.time()))
+        messages = messages.Restrict(
+            f"[ReceivedTime] > '{since:%m/%d/%Y %I:%M %p}' "
+            f"AND [Subject] = '{report_subject}'")
+        messages.Sort('[ReceivedTime]')
+
+        for message in messages:
+            received = datetime.datetime(*message.ReceivedTime.timetuple()[:6])
+            if received <= since or message.Attachments.Count == 0:
+                continue
+            attachment = message.Attachments.Item(1)
+            path = os.path.join(folder_path, str(attachment))
+            attachment.SaveAsFile(path)
+            with open(path, 'rb') as f:
+                yield received.isoformat(), f.read()
+
+
+def open_mailbox(spec=None):
+    """The mailbox named by `spec`, or by $REPORT_MAILBOX.
+
+    `spec` is 'dir:<folder>' (the default, data/inbox), 'mbox:<file>',
+    'imap://<user>@<host>[:<port>]/<folder>' (password from $IMAP_PASSWORD),
+    'imap-local:<mbox file>' (the offline IMAP stand-in) or 'outlook'.
+    """
+    spec = spec or os.environ.get('REPORT_MAILBOX', f'dir:{inbox_path}')
+    kind, _, location = spec.partition(':')
+    if kind == 'dir':
+        return DropFolder(location or inbox_path)
+    if kind == 'mbox':
+        return Mbox(location)
+    if kind in ('imap', 'imaps'):
+        url = urllib.parse.urlsplit(spec)
+        user = urllib.parse.unquote(url.username or '')
+
+        def connect():
+            connection = imaplib.IMAP4_SSL(url.hostname, url.port or 993)
+            connection.login(user, os.environ.get('IMAP_PASSWORD', ''))
+            return connection
+        return Imap(connect, url.path.strip('/') or 'INBOX',
+                    key=f'imap://{user}@{url.hostname}{url.path}')
+    if kind == 'imap-local':
+        return Imap(lambda: LocalImap(location),
+                    key=f'imap-local:{os.path.abspath(location)}')
+    if kind == 'outlook':
+        return Outlook()
+    raise ValueError(f"Unknown mailbox '{spec}'")
+
+
+def read_marks(path=state_path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_marks(marks, path=state_path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(marks, f, indent=1)
+    os.replace(tmp, path)
+
+
+def save_report(source, path=report_path, marks_path=state_path):
+    """Save the newest report in `source` past its high-water mark to `path`.
+
+    Returns True if a new report was saved. The mark is only moved on once
+    the report is on disk, so a failed run reads the same messages again.
+    """
+    marks = read_marks(marks_path)
+    mark = marks.get(source.key)
+    report = None
+    for mark, data in source.new_reports(mark):
+        if data is not None:
+            report = data
+
+    if report is not None:
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(report)
+        os.replace(tmp, path)
+    if mark != marks.get(source.key):
+        marks[source.key] = mark
+        write_marks(marks, marks_path)
+    return report is not None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Save the newest Replicon report from a mailbox')
+    parser.add_argument('mailbox', nargs='?', default=None,
+                        help="'dir:<folder>', 'mbox:<file>', "
+                             "'imap://<user>@<host>/<folder>', "
+                             "'imap-local:<mbox file>' or 'outlook'")
+    parser.add_argument('-o', '--output', default=report_path)
+    args = parser.parse_args()
+
+    if save_report(open_mailbox(args.mailbox), args.output):
+        print (f"Utilization Report saved to {args.output}")
+    else:
+        print ("No new Utilization Report")
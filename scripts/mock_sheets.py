@@ -0,0 +1,315 @@
+import argparse
+import csv
+import datetime
+import functools
+import itertools
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+import gspread
+
+import benchmark
+import sheets
+
+script_path = os.path.abspath(__file__)
+root_path = os.path.dirname(os.path.dirname(script_path))
+mock_path = os.path.join(root_path, 'data', 'mock_sheets')
+
+
+class Client:
+    """Offline stand-in for a gspread client, backed by CSV files.
+
+    Each spreadsheet is a folder under `path` with a CSV file per worksheet
+    and a worksheets.json listing them in order. Only the calls this repo
+    makes are supported. Every call that would be a round trip to Google
+    sleeps `latency` seconds and is counted in `requests`, so startup cost
+    can be measured without a network.
+    """
+
+    def __init__(self, path=mock_path, latency=0.0):
+        self.path = path
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def request(self):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+    def open(self, title):
+        self.request()
+        if not os.path.exists(os.path.join(self.path, title, 'worksheets.json')):
+            raise gspread.SpreadsheetNotFound(title)
+        return Spreadsheet(self, title)
+
+    def open_by_key(self, key):
+        # Spreadsheets are keyed by title
+        return self.open(key)
+
+    def import_csv(self, file_id, data):
+        # Like the Drive import, replaces every worksheet with the CSV
+        self.request()
+        spreadsheet = Spreadsheet(self, file_id)
+        for meta in spreadsheet.worksheets_meta:
+            os.remove(Worksheet(spreadsheet, meta).path)
+        spreadsheet.worksheets_meta = []
+        rows = list(csv.reader(data.decode('utf-8').splitlines()))
+        spreadsheet.add(sheet_title, rows)
+
+
+# Title of the single worksheet a CSV import leaves
+sheet_title = 'Sheet1'
+
+
+class Spreadsheet:
+    def __init__(self, client, title):
+        self.client = client
+        self.title = title
+        self.id = title
+        self.folder = os.path.join(client.path, title)
+        try:
+            with open(os.path.join(self.folder, 'worksheets.json')) as f:
+                meta = json.load(f)
+        except OSError:
+            meta = {'worksheets': [], 'next_id': 0, 'updated': None}
+        self.worksheets_meta = meta['worksheets']
+        self.next_id = meta['next_id']
+        self.lastUpdateTime = meta['updated']
+
+    def save(self):
+        self.lastUpdateTime = datetime.datetime.now(
+            datetime.timezone.utc).isoformat()
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, 'worksheets.json'), 'w') as f:
+            json.dump({'worksheets': self.worksheets_meta,
+                       'next_id': self.next_id,
+                       'updated': self.lastUpdateTime}, f, indent=1)
+
+    def add(self, title, rows):
+        meta = {'title': title, 'id': self.next_id}
+        self.next_id += 1
+        self.worksheets_meta.append(meta)
+        worksheet = Worksheet(self, meta)
+        worksheet.write(rows)
+        return worksheet
+
+    def worksheets(self):
+        self.client.request()
+        return [Worksheet(self, meta) for meta in self.worksheets_meta]
+
+    def worksheet(self, title):
+        self.client.request()
+        for meta in self.worksheets_meta:
+            if meta['title'] == title:
+                return Worksheet(self, meta)
+        raise gspread.WorksheetNotFound(title)
+
+    @property
+    def sheet1(self):
+        self.client.request()
+        return Worksheet(self, self.worksheets_meta[0])
+
+    def add_worksheet(self, title, rows, cols):
+        self.client.request()
+        return self.add(title, [])
+
+    def values_batch_get(self, ranges):
+        self.client.request()
+        return {'spreadsheetId': self.id,
+                'valueRanges': [self.value_range(name) for name in ranges]}
+
+    def value_range(self, name):
+        title, cells = split_range(name)
+        for meta in self.worksheets_meta:
+            if meta['title'] == title:
+                return {'range': name,
+                        'values': Worksheet(self, meta).values(cells)}
+        raise gspread.exceptions.GSpreadException(
+            f'Unable to parse range: {name}')
+
+    def values_update(self, name, params=None, body=None):
+        self.client.request()
+        title, _ = split_range(name)
+        self.worksheet_by_title(title).write(body['values'])
+
+    def batch_update(self, body):
+        # Only the deleteDimension (rows) requests data-pipe.py sends
+        self.client.request()
+        for request in body['requests']:
+            grid = request['deleteDimension']['range']
+            worksheet = self.worksheet_by_id(grid['sheetId'])
+            rows = worksheet.read()
+            del rows[grid['startIndex']:grid['endIndex']]
+            worksheet.write(rows)
+
+    def worksheet_by_title(self, title):
+        return next(Worksheet(self, meta) for meta in self.worksheets_meta
+                    if meta['title'] == title)
+
+    def worksheet_by_id(self, sheet_id):
+        return next(Worksheet(self, meta) for meta in self.worksheets_meta
+                    if meta['id'] == sheet_id)
+
+
+class Worksheet:
+    def __init__(self, spreadsheet, meta):
+        self.spreadsheet = spreadsheet
+        self.title = meta['title']
+        self.id = meta['id']
+        self.path = os.path.join(spreadsheet.folder, f'{self.id}.csv')
+
+    def read(self):
+        try:
+            with open(self.path, newline='') as f:
+                return list(csv.reader(f))
+        except OSError:
+            return []
+
+    def write(self, rows):
+        os.makedirs(self.spreadsheet.folder, exist_ok=True)
+        with open(self.path, 'w', newline='') as f:
+            csv.writer(f).writerows([['' if value is None else value
+                                      for value in row] for row in rows])
+        self.spreadsheet.save()
+
+    def values(self, cells=None):
+        # Like the Sheets API: a range of cells as strings, without trailing
+        # empty cells or rows
+        rows = self.read()
+        if cells:
+            first_row, last_row, first_col, last_col = grid_range(cells)
+            rows = [row[(first_col or 1) - 1:last_col]
+                    for row in rows[(first_row or 1) - 1:last_row]]
+        rows = [list(itertools.dropwhile(lambda value: value == '',
+                                         row[::-1]))[::-1] for row in rows]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    @property
+    def row_count(self):
+        return len(self.read())
+
+    @property
+    def col_count(self):
+        return max((len(row) for row in self.read()), default=0)
+
+    def get_all_values(self):
+        self.spreadsheet.client.request()
+        rows = self.read()
+        width = max((len(row) for row in rows), default=0)
+        return [row + [''] * (width - len(row)) for row in rows]
+
+    def col_values(self, col):
+        self.spreadsheet.client.request()
+        return [value[0] if value else ''
+                for value in self.values(f'{column_letters(col)}:{column_letters(col)}')]
+
+    def row_values(self, row):
+        self.spreadsheet.client.request()
+        values = self.values(f'{row}:{row}')
+        return values[0] if values else []
+
+    def get(self, cells):
+        self.spreadsheet.client.request()
+        return self.values(cells)
+
+    def clear(self):
+        self.spreadsheet.client.request()
+        self.write([])
+
+    def resize(self, rows=None, cols=None):
+        # Worksheets grow as rows are written
+        self.spreadsheet.client.request()
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values])
+
+    def append_rows(self, values, **kwargs):
+        self.spreadsheet.client.request()
+        self.write(self.read() + [[str(value) for value in row]
+                                  for row in values])
+
+    def batch_update(self, data, **kwargs):
+        self.spreadsheet.client.request()
+        rows = self.read()
+        for update in data:
+            first_row, _, first_col, _ = grid_range(update['range'])
+            for i, values in enumerate(update['values']):
+                row = first_row - 1 + i
+                rows.extend([] for _ in range(row + 1 - len(rows)))
+                start = (first_col or 1) - 1
+                rows[row] += [''] * (start + len(values) - len(rows[row]))
+                rows[row][start:start + len(values)] = [str(value)
+                                                        for value in values]
+        self.write(rows)
+
+
+def split_range(name):
+    # "'Title'!A1:B2" (or just "'Title'") as the title and the cells
+    match = re.fullmatch(r"'((?:[^']|'')*)'(?:!(.*))?", name)
+    if match is None:
+        title, _, cells = name.partition('!')
+        return title, cells or None
+    return match.group(1).replace("''", "'"), match.group(2)
+
+
+def grid_range(cells):
+    # 'A5:F5', 'A:A' or '2:10' as 1-based first and last row and column,
+    # None where the range is open
+    bounds = []
+    for cell in cells.split(':'):
+        letters, digits = re.fullmatch(r'([A-Za-z]*)(\d*)', cell).groups()
+        col = functools.reduce(lambda n, c: n * 26 + ord(c) - 64,
+                               letters.upper(), 0)
+        bounds.append((int(digits) if digits else None, col or None))
+    (first_row, first_col), (last_row, last_col) = bounds[0], bounds[-1]
+    return first_row, last_row, first_col, last_col
+
+
+def column_letters(col):
+    letters = ''
+    while col:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def write_spreadsheet(client, title, frames):
+    # Replace a mock spreadsheet with one worksheet per DataFrame, in order
+    shutil.rmtree(os.path.join(client.path, title), ignore_errors=True)
+    spreadsheet = Spreadsheet(client, title)
+    for worksheet_title, df in frames.items():
+        spreadsheet.add(worksheet_title,
+                        [list(df.columns)] + df.astype(str).values.tolist())
+
+
+def seed(path, n_staff, n_years, seed=0):
+    # Fill the mock spreadsheets with synthetic data shaped like the real ones
+    raw = benchmark.synthetic_tables(n_staff, n_years, seed=seed)
+    client = Client(path)
+    write_spreadsheet(client, sheets.hours_title, {sheet_title: raw['hours']})
+    write_spreadsheet(client, sheets.inputs_title,
+                      {'ACTIVITY': raw['activities'],
+                       'DATES': raw['dates'],
+                       'NAMES': raw['employees'],
+                       'TARGETS': raw['targets']})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Create offline mock spreadsheets from synthetic data '
+                    '(use them with MOCK_SHEETS=<path>)')
+    parser.add_argument('--path', default=mock_path)
+    parser.add_argument('--staff', type=int, default=50)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    seed(args.path, args.staff, args.years, args.seed)
+    print (f'Mock spreadsheets written to {args.path}')
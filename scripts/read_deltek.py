@@ -1,50 +1,112 @@
-import pandas as pd
-import numpy as np
-
-july_hours = 'data/july2020.xlsx'
-employee_crosswalk = 'data/employee_crosswalk.csv'
-
-df = pd.read_excel(july_hours,
-                   header=20)
-
-dx = pd.read_csv(employee_crosswalk, index_col=0)
-employee_map = dx.to_dict()
-
-drop_cols = [col for col in df.columns if col.startswith('Unnamed')]
-
-df.drop(drop_cols, axis=1, inplace=True)
-
-def fill_down(df, columns_to_fill):
-    value_dict = dict(zip(columns_to_fill, [None]*len(columns_to_fill)))
-    filled_df = pd.DataFrame(columns=df.columns)
-    for _, row in df.iterrows():
-        for column in columns_to_fill:        
-            if row[column] is np.nan:
-                row[column] = value_dict[column]
-            else:
-                value_dict[column] = row[column]
-        filled_df = filled_df.append(row, sort=False)
-    return filled_df
+import argparse
+import itertools
+import os
 
+import pandas as pd
+from openpyxl import load_workbook
 
-df = fill_down(df, ['Project', 'Employee'])
-
-df.dropna(axis='rows', subset=['Date'], inplace=True)
+script_path = os.path.abspath(__file__)
+root_path = os.path.dirname(os.path.dirname(script_path))
+folder_path = os.path.join(root_path, 'data')
 
-df.drop(['Project.1', 'UDT10', 'Comments'], axis=1, inplace=True)
+employee_crosswalk = os.path.join(folder_path, 'employee_crosswalk.csv')
+output_path = os.path.join(folder_path, 'paste_into_google_sheet.csv')
 
 mapper = {'Project': 'Activity Name',
         'Employee': 'User Name',
         'Date': 'Entry Date',
         'Hours': 'Hours Worked'}
-df.rename(columns=mapper, inplace=True)
-
-df['User Name'] = df['User Name'].map(employee_map['User Name'])
-
-df = df[['User Name', 'Entry Date', 'Activity Name', 'Hours Worked']]
-
-df.sort_values(['User Name', 'Entry Date'], inplace=True)
-
-df['Time Off Hrs'] = 0
 
-df.to_csv('data/paste_into_google_sheet.csv', index=False)
\ No newline at end of file
+# Columns of the output, as in the Utilization-Hours sheet
+output_columns = ['User Name', 'Entry Date', 'Activity Name', 'Hours Worked',
+                  'Time Off Hrs']
+
+
+def read_export(path, header=20, chunksize=10000):
+    # Stream the Deltek export in chunks of rows rather than loading the
+    # whole workbook. Column names follow pd.read_excel (blank headers are
+    # 'Unnamed: i', repeated headers get a '.1' suffix)
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(min_row=header + 1, values_only=True)
+        columns = []
+        for i, col in enumerate(next(rows)):
+            col = f'Unnamed: {i}' if col is None else str(col)
+            name, n = col, 0
+            while name in columns:
+                n += 1
+                name = f'{col}.{n}'
+            columns.append(name)
+
+        while True:
+            chunk = list(itertools.islice(rows, chunksize))
+            if not chunk:
+                break
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        wb.close()
+
+
+def fill_down(df, columns_to_fill, previous=None):
+    # Forward fill blank cells, carrying over the last values from the
+    # previous chunk (if any) into the leading blanks of this one
+    filled = df[columns_to_fill].ffill()
+    if previous:
+        filled = filled.fillna(previous)
+    df[columns_to_fill] = filled
+    return df
+
+
+def convert(df, employee_map):
+    df = df.dropna(axis='rows', subset=['Date'])
+    df = df.rename(columns=mapper)
+
+    df['User Name'] = df['User Name'].map(employee_map)
+    df['Entry Date'] = pd.to_datetime(df['Entry Date'])
+    df['Hours Worked'] = pd.to_numeric(df['Hours Worked']).astype(float)
+
+    df = df[output_columns[:-1]].copy()
+    df['Time Off Hrs'] = 0
+    return df
+
+
+def convert_export(path, output=output_path, crosswalk=employee_crosswalk,
+                   chunksize=10000):
+    dx = pd.read_csv(crosswalk, index_col=0)
+    employee_map = dx.to_dict()['User Name']
+
+    # Write each chunk as soon as it's converted so memory stays bounded.
+    # Rows are written in export order (grouped by project and employee)
+    columns_to_fill = ['Project', 'Employee']
+    previous = None
+    header = True
+    n_rows = 0
+    for chunk in read_export(path, chunksize=chunksize):
+        chunk = chunk.drop([col for col in chunk.columns
+                            if col.startswith('Unnamed')], axis=1)
+        chunk = fill_down(chunk, columns_to_fill, previous)
+        previous = chunk[columns_to_fill].ffill().iloc[-1].dropna().to_dict()
+
+        df = convert(chunk, employee_map)
+        df.to_csv(output, index=False, header=header,
+                  mode='w' if header else 'a')
+        header = False
+        n_rows += len(df)
+
+    # An export without rows still replaces the last output
+    if header:
+        pd.DataFrame(columns=output_columns).to_csv(output, index=False)
+    return n_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert a Deltek hours export for the Utilization-Hours sheet')
+    parser.add_argument('path', help='Deltek detail export (.xlsx)')
+    parser.add_argument('-o', '--output', default=output_path)
+    parser.add_argument('--crosswalk', default=employee_crosswalk)
+    parser.add_argument('--chunksize', type=int, default=10000)
+    args = parser.parse_args()
+
+    n_rows = convert_export(args.path, args.output, args.crosswalk, args.chunksize)
+    print(f"{n_rows} rows written to {args.output}")
@@ -0,0 +1,149 @@
+import collections
+import os
+import threading
+
+import engine
+import snapshot
+import timing
+
+# Seconds between checks for a new snapshot. Syncing with the source only
+# goes back to it once the snapshot is older than snapshot.ttl
+interval = int(os.environ.get('REFRESH_INTERVAL', 60))
+
+# The loaded snapshot: when each table was written, the tables loaded so
+# far, the index_users() index of each loaded monthly table (sorted by user)
+# and the engine.Calendar of the DATES sheet
+Data = collections.namedtuple('Data', ['stamps', 'tables', 'user_indexes',
+                                       'calendar'])
+
+
+def served(name):
+    # Views read the monthly tables and roll-ups, never the hours
+    return not name.startswith('hours')
+
+
+def by_year(name):
+    # A fiscal year's partition, e.g. monthly_2021
+    return name.rpartition('_')[2].isdigit()
+
+
+class Refresher:
+    """Keeps the snapshot tables loaded, refreshing them in the background.
+
+    Every `interval` seconds a daemon thread runs `sync` (which brings the
+    snapshot up to date with the source, e.g. sources.sync_snapshot; None to
+    only pick up snapshots written by another process) and loads any table
+    whose stamp changed. The new Data then replaces the old in one
+    assignment, so a request always sees a complete, consistent set of
+    tables and never waits on a reload. The very first load reads the
+    snapshot already on disk without syncing, so the first page doesn't wait
+    on the source either; the thread syncs straight after.
+
+    Tables partitioned by fiscal year are only read once a view asks for
+    their year with load_year(), and from then on kept up to date like the
+    rest, so a process only holds the years it has served.
+    """
+
+    def __init__(self, sync=None, interval=interval, path=snapshot.snapshot_path):
+        self.sync = sync
+        self.interval = interval
+        self.path = path
+        self.data = None
+        # Syncs and loads are locked separately, so a page waiting on a load
+        # never waits on a sync as well
+        self.sync_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def current(self):
+        if self.data is None:
+            # Only wait on a sync when there's no snapshot to serve yet
+            self.refresh(sync=not snapshot.stamps(self.path))
+        return self.data
+
+    def refresh(self, sync=True):
+        # Returns True if new tables were swapped in
+        if sync and self.sync is not None:
+            with self.sync_lock:
+                self.sync()
+        with self.lock:
+            stamps = self.stamps()
+            data = self.data or Data({}, {}, {}, None)
+            if stamps == data.stamps:
+                timing.count('refresher', 'unchanged')
+                return False
+            # Years already loaded are loaded again when they change
+            self.data = self.load(stamps, data, {name for name in data.tables
+                                                 if by_year(name)})
+            timing.count('refresher', 'swapped')
+            return True
+
+    def load_year(self, year):
+        # The current Data with the fiscal year's tables loaded, reading them
+        # (and any newer tables) the first time the year is asked for
+        data = self.current()
+        names = {name for name in data.stamps if by_year(name)
+                 and name.rpartition('_')[2] == str(year)}
+        if names.issubset(data.tables):
+            return data
+        with self.lock:
+            data = self.data
+            if not names.issubset(data.tables):
+                loaded = {name for name in data.tables if by_year(name)}
+                self.data = self.load(self.stamps(), data, loaded | names)
+                timing.count('refresher', 'loaded year')
+            return self.data
+
+    def stamps(self):
+        return {name: stamp for name, stamp in snapshot.stamps(self.path).items()
+                if served(name)}
+
+    def load(self, stamps, data, years):
+        # New Data for the stamps, reusing the tables in `data` that haven't
+        # changed and leaving out the year tables not in `years`
+        with timing.stage('load tables') as record:
+            tables = {}
+            user_indexes = {}
+            for name, stamp in stamps.items():
+                if by_year(name) and name not in years:
+                    continue
+                if data.stamps.get(name) == stamp and name in data.tables:
+                    tables[name] = data.tables[name]
+                    if name in data.user_indexes:
+                        user_indexes[name] = data.user_indexes[name]
+                    continue
+                table = snapshot.read_table(name, self.path)
+                if snapshot.partitions([name], 'monthly'):
+                    table, user_indexes[name] = engine.index_users(table)
+                tables[name] = table
+            record['rows'] = sum(len(table) for table in tables.values())
+
+        calendar = data.calendar
+        if calendar is None or stamps.get('calendar') != data.stamps.get('calendar'):
+            calendar = engine.Calendar.from_frame(tables['calendar'])
+
+        return Data(stamps, tables, user_indexes, calendar)
+
+    def run(self):
+        # The first load may have skipped the sync, so sync straight away
+        wait = 0
+        while not self.stopped.wait(wait):
+            wait = self.interval
+            try:
+                self.current()
+                self.refresh()
+            except Exception:
+                # Keep serving the tables already loaded and try again later
+                timing.count('refresher', 'failed')
+                timing.logger.exception('Refresh failed')
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name='refresher')
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,561 @@
+import collections
+import functools
+
+import numpy as np
+import pandas as pd
+
+import engine
+import forecast
+import timing
+from engine import list_months, semester1, semester2
+
+# Chart colors: Predictive mode, then Classic mode
+util_color = '#006040'
+r_and_d_color = '#c89051'
+other_color = '#f0ca6c'
+time_off_color = '#A7A7A7'
+full_time_color = '#ee6642'
+
+c_util_color = '#5B9BD5'
+c_r_and_d_color = '#ED7D31'
+c_other_color = '#A5A5A5'
+c_time_off_color = '#FFC000'
+c_full_time_color = '#FF0000'
+
+# Everything plot_hours needs about a computed report, so reports for
+# different users can be built and plotted concurrently
+UtilizationReport = collections.namedtuple(
+    'UtilizationReport',
+    ['table', 'names', 'method', 'by_semester', 'this_month',
+     'last_day_worked', 'valid_date'])
+
+
+@timing.timed('build utilization')
+def build_utilization(names, monthly, dates, 
+                      method="Month to Date", provided_utilization=None,
+                      by_semester=False, user_index=None, targets=None):
+    # The report for one forecasting method (see forecast.methods)
+    return select_method(build_forecasts(names, monthly, dates,
+                                         provided_utilization, by_semester,
+                                         user_index, targets), method)
+
+
+@timing.timed('build group utilization')
+def build_group_utilization(dimension, group, groups, dates,
+                            method="Month to Date",
+                            provided_utilization=None, by_semester=False):
+    return select_method(build_group_forecasts(dimension, group, groups, dates,
+                                               provided_utilization,
+                                               by_semester), method)
+
+
+def select_method(reports, method):
+    if method not in reports:
+        raise ValueError(f"No forecast for {method!r}; 'Provided Rate' needs "
+                         "provided_utilization")
+    return reports[method]
+
+
+def build_forecasts(names, monthly, dates, provided_utilization=None,
+                    by_semester=False, user_index=None, targets=None):
+    """Build the selected users' reports for every forecasting method at once.
+
+    Returns a dict of method to UtilizationReport, so switching methods needs
+    no recomputing. `provided_utilization` (%) adds the 'Provided Rate'
+    method; `targets` are the planned utilization the 'Planned' method uses.
+    `dates` is the DATES table or its engine.Calendar.
+    """
+    # Sum monthly hours and FTE for all selected users (user_index is the
+    # monthly table's engine.index_users() index, if it has one)
+    names = list(dict.fromkeys(names))
+    per_user, utilization, last_days = engine.select_monthly(monthly, names,
+                                                             user_index)
+    planned = planned_hours(per_user, targets, names)
+    return forecast_reports(utilization, last_days, names, dates,
+                            None if planned is None else planned.sum(axis=0),
+                            provided_utilization, by_semester)
+
+
+def build_group_forecasts(dimension, group, groups, dates,
+                          provided_utilization=None, by_semester=False):
+    # Same reports for a group, read from its precomputed roll-up. A group
+    # has no single planned utilization to chart, so the reports carry no
+    # names, but the roll-up has the hours its members' targets plan for
+    utilization, last_days = engine.select_group(groups, dimension, group)
+    planned = utilization.pop('Planned Hours').to_numpy()
+    return forecast_reports(utilization, last_days, [], dates, planned,
+                            provided_utilization, by_semester)
+
+
+def planned_hours(per_user, targets, names):
+    # Billable hours each user's targets plan for each month, as a
+    # (users x 12) array; NaN wherever someone has no plan
+    if targets is None:
+        return None
+    plan = (targets.drop_duplicates('User Name').set_index('User Name')
+            .reindex(names)[list_months].to_numpy(dtype=float))
+    fte = per_user['FTE'].to_numpy().reshape(len(names), len(list_months))
+    return plan * fte
+
+
+def forecast_reports(utilization, last_days, names, dates, planned=None,
+                     provided_utilization=None, by_semester=False):
+    # Reports for every method from the selection's summed monthly hours
+    
+    # Save variables related to this month for prediction later on
+    latest_day = last_days.max()
+    this_month = latest_day.strftime('%b')
+    days_remaining = engine.days_left(dates, [latest_day]).iloc[0]
+    
+    # get minimum of the last day worked
+    last_day_worked = last_days.min()
+
+    result = forecast.forecast(
+        utilization['Billable'].to_numpy()[None, :],
+        utilization['FTE'].to_numpy()[None, :],
+        [engine.month_dict[this_month]], [days_remaining],
+        planned_hours=None if planned is None else planned[None, :],
+        provided=(None if provided_utilization is None
+                  else provided_utilization / 100),
+        by_semester=by_semester)
+
+    # Format last day worked for printing
+    last_day_f = last_day_worked.strftime('%A, %B %e, %Y')
+
+    reports = {}
+    for method in result.rates:
+        table = utilization.copy()
+        table['Utilization'] = result.utilization[0]
+        table['Util to Date'] = result.util_to_date[0]
+        table['Predicted Hours'] = result.predicted_hours[method][0]
+        table['Predicted Utilization'] = result.predicted_utilization[method][0]
+        reports[method] = UtilizationReport(table, names, method, by_semester,
+                                            this_month, last_day_worked,
+                                            last_day_f)
+    return reports
+
+
+@timing.timed('forecast users')
+def forecast_users(names, monthly, dates, method="Year (Semester) to Date",
+                   provided_utilization=None, by_semester=False,
+                   user_index=None, targets=None):
+    """Forecast each user in `names` on their own, all in one pass.
+
+    Returns a table with a row per user with hours this year: data valid
+    through, utilization to date, and the predicted utilization for the year
+    with `method` and with every other method.
+    """
+    names = list(dict.fromkeys(names))
+    per_user, _, last_days = engine.select_monthly(monthly, names, user_index)
+    shape = (len(names), len(list_months))
+    billable = per_user['Billable'].to_numpy().reshape(shape)
+    fte = per_user['FTE'].to_numpy().reshape(shape)
+
+    # Users without hours this year have nothing to forecast
+    active = last_days.notna().to_numpy()
+    last_days = last_days[active]
+    this_month = np.asarray(engine.fiscal_months(last_days).codes, dtype=int)
+    days_remaining = engine.days_left(dates, last_days).to_numpy()
+    planned = planned_hours(per_user, targets, names)
+
+    result = forecast.forecast(
+        billable[active], fte[active], this_month, days_remaining,
+        planned_hours=None if planned is None else planned[active],
+        provided=(None if provided_utilization is None
+                  else provided_utilization / 100),
+        by_semester=by_semester)
+    if method not in result.rates:
+        raise ValueError(f"No forecast for {method!r}; 'Provided Rate' needs "
+                         "provided_utilization")
+
+    to_date = np.arange(len(list_months)) <= this_month[:, None]
+    summary = pd.DataFrame({
+        'User Name': last_days.index,
+        'Data Valid Through': last_days.dt.strftime('%A, %B %e, %Y').to_numpy(),
+        'Utilization to Date': ((billable[active] * to_date).sum(axis=1)
+                                / (fte[active] * to_date).sum(axis=1)),
+        'Predicted Utilization': result.predicted_utilization[method][:, -1],
+    })
+    for other, utilization in result.predicted_utilization.items():
+        summary[f'Predicted ({other})'] = utilization[:, -1]
+    return summary
+
+
+def classic_bars(report):
+    """Percent of FTE spent on each kind of work, as in the Classic chart.
+
+    One row per month (billable hours month to date), then the S1 and S2
+    averages to date when the report is by semester, or else the Year's.
+    Missing values are 0.
+    """
+    data = report.table
+    this_month = report.this_month
+    current_month_index = list_months.index(this_month)
+
+    billable_hours = data.loc[:, 'Util to Date']*100
+    r_and_d_hours = (data.loc[:, 'R&D']/data.loc[:, 'FTE'])*100
+    other_hours = (data.loc[:, 'Other']/data.loc[:, 'FTE'])*100
+    time_off_hours = (data.loc[:, 'Time Off']/data.loc[:, 'FTE'])*100
+
+    if report.by_semester:
+        # update hours for S1
+        s1_upper = list_months[min(6, current_month_index)]
+        data_s1 = data.loc[:s1_upper, :]
+
+        billable_hours = pd.concat([billable_hours, pd.Series(data_s1['Billable'].sum()/data_s1['FTE'].sum()*100, index=['S1'])])
+        r_and_d_hours = pd.concat([r_and_d_hours, pd.Series(data_s1['R&D'].sum()/data_s1['FTE'].sum()*100, index=['S1'])])
+        other_hours = pd.concat([other_hours, pd.Series(data_s1['Other'].sum()/data_s1['FTE'].sum()*100, index=['S1'])])
+        time_off_hours = pd.concat([time_off_hours, pd.Series(data_s1['Time Off'].sum()/data_s1['FTE'].sum()*100, index=['S1'])])
+
+        # update hours for S2
+        s2_lower = list_months[6]
+        s2_upper = list_months[current_month_index]
+        data_s2 = data.loc[s2_lower:s2_upper, :]
+
+        billable_hours = pd.concat([billable_hours, pd.Series(data_s2['Billable'].sum()/data_s2['FTE'].sum()*100, index=['S2'])])
+        r_and_d_hours = pd.concat([r_and_d_hours, pd.Series(data_s2['R&D'].sum()/data_s2['FTE'].sum()*100, index=['S2'])])
+        other_hours = pd.concat([other_hours, pd.Series(data_s2['Other'].sum()/data_s2['FTE'].sum()*100, index=['S2'])])
+        time_off_hours = pd.concat([time_off_hours, pd.Series(data_s2['Time Off'].sum()/data_s2['FTE'].sum()*100, index=['S2'])])
+
+    else:
+        # update hours with year average
+        billable_hours = pd.concat([billable_hours, pd.Series(data['Billable'].sum()/data.loc[:this_month, 'FTE'].sum()*100, index=['Year'])])
+        r_and_d_hours = pd.concat([r_and_d_hours, pd.Series(data['R&D'].sum()/data.loc[:this_month, 'FTE'].sum()*100, index=['Year'])])
+        other_hours = pd.concat([other_hours, pd.Series(data['Other'].sum()/data.loc[:this_month, 'FTE'].sum()*100, index=['Year'])])
+        time_off_hours = pd.concat([time_off_hours, pd.Series(data['Time Off'].sum()/data.loc[:this_month, 'FTE'].sum()*100, index=['Year'])])
+
+    return pd.DataFrame({'Utilization': billable_hours,
+                         'R&D': r_and_d_hours,
+                         'Other': other_hours,
+                         'Time Off': time_off_hours}).fillna(0)
+
+
+def planned_utilization(report, targets):
+    # The first selected person's planned utilization (%) for each month, or
+    # None without a plan
+    if targets is None:
+        return None
+    target_df = targets.loc[targets['User Name'].isin(report.names), list_months]
+    target_df[list_months] = target_df[list_months].apply(pd.to_numeric)
+    target_df.fillna(0, inplace=True)
+    if target_df.empty:
+        return None
+    return [t * 100 for t in target_df.values.tolist()[0]]
+
+
+@functools.lru_cache(maxsize=None)
+def load_matplotlib():
+    # matplotlib is only imported once a PNG is drawn, since the interactive
+    # charts (chart_spec) don't need it. Set chart fonts once: rcParams are
+    # shared by the whole process
+    from matplotlib import rcParams
+    rcParams['font.sans-serif'] = 'Tahoma'
+    rcParams['font.family'] = 'sans-serif'
+    rcParams['font.size'] = 13
+
+
+@timing.timed('plot hours')
+def plot_hours(report, target, mode='focus', targets=None):
+    load_matplotlib()
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import FuncFormatter, MaxNLocator
+
+    data = report.table
+    by_semester = report.by_semester
+    this_month = report.this_month
+
+    util_target = target
+    
+    util_value = data.loc['Mar', 'Predicted Utilization'] * 100
+
+    current_month = list_months.index(this_month)
+    current_month_index = current_month
+
+    # Build the figure without pyplot, whose current-figure state isn't thread safe
+    fig = Figure(figsize=[10.75,7])
+    ax1 = fig.subplots()
+
+    # Plot data by mode
+    if mode == 'Predictive':
+        ind = np.arange(12)
+        # Hide grid lines to denote prediction portion of graph, Note zorder must be specified
+        # in fill_between call
+        for i in np.arange(current_month_index + 1, 13):
+            ax1.axes.axvline(i, color='white', linewidth=2)
+        
+        if by_semester:
+            ax1.plot(data.loc[semester1, 'Predicted Utilization']*100, color=util_color, linewidth=3, alpha=.85)
+            ax1.plot(data.loc[semester2, 'Predicted Utilization']*100, color=util_color, linewidth=3, alpha=.85)
+        else:
+            ax1.plot(data.loc[:,'Predicted Utilization']*100, color=util_color, linewidth=3, alpha=.85)
+        
+        # Plot actuals
+        ax1.plot(data['Utilization']*100, color=util_color, marker='o', lw=0)
+
+        # Plot projected
+        ax1.plot(data['Util to Date']*100, color=util_color, marker='x', lw=0, alpha=1)
+
+        # Plot targets
+        ax1.plot([util_target]*12, color=util_color, linestyle='dotted')
+        
+        # Label actuals
+        for x, y in zip(np.arange(0,12), data['Utilization']*100):
+            label = f'{y:.0f}%'
+            if y > 0:
+                ax1.annotate(label, 
+                            (x, y), 
+                            textcoords="offset points", 
+                            xytext=(10,0), 
+                            ha='left',
+                            va='center',
+                            color = 'dimgrey')
+        
+        # Adjust axes ranges
+        ax1.set_ylim(0, 120)
+
+        # Adjust number of labels
+        ax1.yaxis.set_major_locator(MaxNLocator(6))
+        
+        x_labels = data.index
+        
+        # Label
+        ax1.text(11.1, util_value-3, f' Predicted \n Utilization ({int(util_value)}%)', 
+                color=util_color)
+        
+        # Set title
+        ax1.set_title('Are you on track to meet your utilization target?', 
+                      loc='right', 
+                      fontsize=15)
+
+    elif mode == 'Classic':           
+        width = .25
+        bars = classic_bars(report)
+        ind = np.arange(len(bars))
+        x_labels = bars.index
+        billable_hours = bars['Utilization']
+        r_and_d_hours = bars['R&D']
+        other_hours = bars['Other']
+        time_off_hours = bars['Time Off']
+
+        ax1.bar(ind, billable_hours, width=width, color=c_util_color, label='Utilization')
+        ax1.bar(ind, r_and_d_hours, width=width, bottom=billable_hours, color=c_r_and_d_color, label='R&D')
+        ax1.bar(ind, other_hours, width=width, bottom=billable_hours + r_and_d_hours, color=c_other_color, label='Other')
+        ax1.bar(ind, time_off_hours, width=width, bottom=billable_hours + r_and_d_hours+other_hours, color=c_time_off_color, label='Time Off')
+        
+        # Plot targets
+        ax1.plot([util_target]*len(ind), color=c_util_color, linestyle='dotted')
+        ax1.plot([110]*len(ind), color='#70AD47', linestyle='dotted')
+        ax1.plot([125]*len(ind), color=full_time_color, linestyle='dotted')        
+        
+        # Plot planned utilization
+        target_util = planned_utilization(report, targets)
+        if target_util is not None:
+            ax1.plot(target_util, marker='s', markerfacecolor=c_util_color, markeredgewidth=1, markeredgecolor='white', lw=0, alpha=1, label = 'Planned Utilization')
+        
+        # Add legend
+        ax1.legend(loc='upper center', bbox_to_anchor=(0.5, -0.05), ncol=5, frameon=False, columnspacing=3)
+
+        # Adjust axes ranges
+        ax1.set_ylim(0, 140)
+        
+        # Adjust number of labels
+        ax1.yaxis.set_major_locator(MaxNLocator(7))
+
+    # Format y labels as percent
+    ax1.yaxis.set_major_formatter(FuncFormatter('{:.0f}%'.format))
+
+    # Set x labels
+    ax1.set_xticks(ind)
+    ax1.set_xticklabels(x_labels)
+
+    # Add grid Lines
+    ax1.yaxis.grid(False)
+    ax1.xaxis.grid(True)
+
+    # Customize grid lines
+    ax1.axes.grid(axis='x', linestyle='-')
+
+    # Set below graph objects
+    ax1.set_axisbelow(True)
+
+    # Remove Axes ticks
+    ax1.tick_params(axis='both', which='both', 
+                    bottom=False, top=False, left=False, right=False)
+
+    # Recolor axis labels
+    ax1.tick_params(colors='dimgrey')
+
+    # Remove axes spines
+    ax1.spines['top'].set_visible(False)
+    ax1.spines['left'].set_visible(False)
+    ax1.spines['right'].set_visible(False)
+    ax1.spines['bottom'].set_visible(True)
+    ax1.spines['bottom'].set_color('silver')
+
+    # Indicate current month
+    ax1.get_xticklabels()[current_month_index].set_fontweight('bold')
+    ax1.get_xticklabels()[current_month_index].set_color(
+        c_util_color if mode == 'Classic' else util_color)
+    
+    return fig, util_value
+
+
+def records(df):
+    # DataFrame rows as JSON-ready dicts, with null for NaN
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+@timing.timed('chart spec')
+def chart_spec(report, target, mode='Predictive', targets=None):
+    """The plot_hours chart as a Vega-Lite spec, drawn by the browser.
+
+    Returns the spec (plain dicts, ready for st.vega_lite_chart) and the
+    predicted utilization (%), like plot_hours. The spec only holds the
+    dozen or so plotted values, so nothing is rendered on the server.
+    """
+    data = report.table
+    this_month = report.this_month
+    current_month_index = list_months.index(this_month)
+    util_value = float(data.loc['Mar', 'Predicted Utilization'] * 100)
+    label_color = c_util_color if mode == 'Classic' else util_color
+
+    # Bold the current month and, in Predictive mode, hide the grid lines of
+    # the months still to be predicted
+    is_current = f"datum.value === '{this_month}'"
+    is_predicted = (f"indexof({list(list_months)}, datum.value) > "
+                    f"{current_month_index}")
+    x = {'field': 'Month', 'type': 'ordinal', 'title': None,
+         'axis': {'labelAngle': 0, 'ticks': False, 'domainColor': 'silver',
+                  'grid': True, 'labelPadding': 8,
+                  'labelColor': {'condition': {'test': is_current,
+                                               'value': label_color},
+                                 'value': 'dimgrey'},
+                  'labelFontWeight': {'condition': {'test': is_current,
+                                                    'value': 'bold'},
+                                      'value': 'normal'}}}
+    y_axis = {'title': None, 'grid': False, 'domain': False, 'ticks': False,
+              'labelColor': 'dimgrey', 'labelExpr': "datum.value + '%'"}
+
+    def rule(value, color):
+        return {'data': {'values': [{'Target': value}]},
+                'mark': {'type': 'rule', 'color': color, 'strokeDash': [2, 2]},
+                'encoding': {'y': {'field': 'Target', 'type': 'quantitative'}}}
+
+    if mode == 'Predictive':
+        points = pd.DataFrame({
+            'Month': list_months,
+            'Predicted': data['Predicted Utilization'].values * 100,
+            'Utilization': data['Utilization'].values * 100,
+            'Util to Date': data['Util to Date'].values * 100,
+            # Semesters are predicted separately, so draw them as two lines
+            'Period': ['S1' if report.by_semester and month in semester1
+                       else 'S2' if report.by_semester else 'Year'
+                       for month in list_months]})
+        points['Label'] = [f'{y:.0f}%' if y > 0 else None
+                           for y in points['Utilization']]
+        x['sort'] = list(list_months)
+        x['axis']['gridOpacity'] = {'condition': {'test': is_predicted,
+                                                  'value': 0},
+                                    'value': 1}
+        y = {'type': 'quantitative', 'scale': {'domain': [0, 120]},
+             'axis': dict(y_axis, tickCount=6)}
+        layers = [
+            {'mark': {'type': 'line', 'color': util_color, 'strokeWidth': 3,
+                      'opacity': .85},
+             'encoding': {'y': dict(y, field='Predicted'),
+                          'detail': {'field': 'Period', 'type': 'nominal'}}},
+            # Actuals
+            {'mark': {'type': 'point', 'filled': True, 'size': 60,
+                      'color': util_color, 'opacity': 1},
+             'encoding': {'y': dict(y, field='Utilization'),
+                          'tooltip': [{'field': 'Month'},
+                                      {'field': 'Utilization', 'format': '.1f'},
+                                      {'field': 'Util to Date', 'format': '.1f'}]}},
+            # Projected
+            {'mark': {'type': 'point', 'shape': 'cross', 'angle': 45,
+                      'size': 60, 'filled': True, 'color': util_color},
+             'encoding': {'y': dict(y, field='Util to Date')}},
+            # Label actuals
+            {'transform': [{'filter': 'datum.Label != null'}],
+             'mark': {'type': 'text', 'align': 'left', 'dx': 10,
+                      'color': 'dimgrey'},
+             'encoding': {'y': dict(y, field='Utilization'),
+                          'text': {'field': 'Label'}}},
+            rule(target, util_color),
+            {'data': {'values': [{'Month': 'Mar', 'Predicted': util_value}]},
+             'mark': {'type': 'text', 'align': 'left', 'dx': 12, 'dy': 8,
+                      'color': util_color,
+                      'text': ['Predicted',
+                               f'Utilization ({int(util_value)}%)']},
+             'encoding': {'y': dict(y, field='Predicted')}},
+        ]
+        title = {'text': 'Are you on track to meet your utilization target?',
+                 'anchor': 'end', 'fontSize': 15, 'fontWeight': 'normal'}
+
+    elif mode == 'Classic':
+        bars = classic_bars(report)
+        kinds = list(bars.columns)
+        colors = [c_util_color, c_r_and_d_color, c_other_color,
+                  c_time_off_color]
+        points = bars.rename_axis('Month').reset_index().melt(
+            'Month', var_name='Kind', value_name='Percent')
+        points['Order'] = points['Kind'].map(kinds.index)
+
+        planned = planned_utilization(report, targets)
+        if planned is not None:
+            kinds.append('Planned Utilization')
+            colors.append(c_util_color)
+
+        x['sort'] = list(bars.index)
+        # Bars a quarter of the column wide, as in plot_hours
+        x['scale'] = {'paddingInner': .75, 'paddingOuter': .375}
+        y = {'type': 'quantitative', 'scale': {'domain': [0, 140]},
+             'axis': dict(y_axis, tickCount=7)}
+        color = {'field': 'Kind', 'type': 'nominal',
+                 'scale': {'domain': kinds, 'range': colors},
+                 'legend': {'orient': 'bottom', 'title': None,
+                            'symbolType': 'square', 'columnPadding': 30}}
+        layers = [
+            {'mark': {'type': 'bar'},
+             'encoding': {'y': dict(y, field='Percent', stack='zero'),
+                          'color': color,
+                          'order': {'field': 'Order'},
+                          'tooltip': [{'field': 'Month'}, {'field': 'Kind'},
+                                      {'field': 'Percent', 'format': '.1f'}]}},
+            rule(target, c_util_color),
+            rule(110, '#70AD47'),
+            rule(125, full_time_color),
+        ]
+        if planned is not None:
+            layers.append(
+                {'data': {'values': records(pd.DataFrame({
+                    'Month': list_months, 'Kind': 'Planned Utilization',
+                    'Percent': planned}))},
+                 'mark': {'type': 'square', 'size': 90, 'opacity': 1,
+                          'stroke': 'white', 'strokeWidth': 1},
+                 'encoding': {'y': dict(y, field='Percent'),
+                              'color': color,
+                              'tooltip': [{'field': 'Month'},
+                                          {'field': 'Kind'},
+                                          {'field': 'Percent', 'format': '.1f'}]}})
+        title = None
+
+    else:
+        raise ValueError(f"Unknown chart mode '{mode}'")
+
+    # Target lines span the chart; everything else is placed by month
+    for layer in layers:
+        if layer['mark']['type'] != 'rule':
+            layer['encoding']['x'] = x
+
+    spec = {'$schema': 'https://vega.github.io/schema/vega-lite/v4.json',
+            'height': 450,
+            'data': {'values': records(points)},
+            'layer': layers,
+            'config': {'font': 'Tahoma', 'view': {'stroke': None},
+                       'axis': {'labelFontSize': 13},
+                       'legend': {'labelFontSize': 13},
+                       'text': {'fontSize': 13}}}
+    if title:
+        spec['title'] = title
+    return spec, util_value
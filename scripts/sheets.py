@@ -0,0 +1,462 @@
+import concurrent.futures
+import json
+import os
+
+import pandas as pd
+
+import engine
+import snapshot
+import timing
+
+scope = ['https://spreadsheets.google.com/feeds',
+         'https://www.googleapis.com/auth/drive']
+
+hours_title = 'Utilization-Hours'
+inputs_title = 'Utilization-Inputs'
+
+# Log of upserted and deleted hours rows, appended by the incremental upload
+# in data-pipe.py. It's recreated by every full upload, so its worksheet id
+# identifies which full upload the log follows
+changes_title = 'CHANGES'
+
+# Rows of the hours report are unique on these columns (Activity Name after
+# appending the Time Off Type)
+hours_key = ['User Name', 'Entry Date', 'Activity Name']
+hours_columns = ['Hours Worked', 'Time Off Hrs']
+
+# Per-user monthly fact table published by data-pipe.py
+monthly_title = 'MONTHLY'
+
+# Worksheets of the inputs spreadsheet by table name, read together in one
+# request
+input_titles = {'activities': 'ACTIVITY',
+                'dates': 'DATES',
+                'employees': 'NAMES',
+                'targets': 'TARGETS'}
+
+
+def authorize():
+    # MOCK_SHEETS=<folder> reads local mock spreadsheets instead (see
+    # mock_sheets.py), e.g. to work offline
+    if os.environ.get('MOCK_SHEETS'):
+        import mock_sheets
+        return mock_sheets.Client(
+            os.environ['MOCK_SHEETS'],
+            latency=float(os.environ.get('MOCK_SHEETS_LATENCY', 0)))
+    # Imported here so the app can serve the local snapshot without loading
+    # the Google client libraries
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+    try:
+        # creds for local development
+        creds = ServiceAccountCredentials.from_json_keyfile_name(
+            'secrets/gs_credentials.json', scope
+        )
+    except:
+        # creds for heroku deployment
+        json_creds = os.environ.get("GOOGLE_SHEETS_CREDS_JSON")
+        creds_dict = json.loads(json_creds)
+        creds_dict["private_key"] = creds_dict["private_key"].replace("\\\\n", "\n")
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    return gspread.authorize(creds)
+
+
+def worksheet_frame(wks):
+    with timing.stage('read worksheet', worksheet=wks.title) as record:
+        data = wks.get_all_values()
+        headers = data.pop(0)
+        record['rows'] = len(data)
+    return pd.DataFrame(data, columns=headers)
+
+
+def range_name(title, cells=None):
+    # A1 notation for a whole worksheet, or some of its cells
+    name = "'{}'".format(title.replace("'", "''"))
+    return f'{name}!{cells}' if cells else name
+
+
+def batch_values(spreadsheet, ranges):
+    # Values of several ranges in a single request rather than one per
+    # worksheet
+    with timing.stage('batch get', spreadsheet=spreadsheet.title,
+                      ranges=len(ranges)) as record:
+        value_ranges = spreadsheet.values_batch_get(ranges)['valueRanges']
+        values = [value_range.get('values', []) for value_range in value_ranges]
+        record['rows'] = sum(len(rows) for rows in values)
+    return values
+
+
+def values_frame(values):
+    # Like worksheet_frame, from API values, which leave out trailing empty
+    # cells
+    headers = values[0] if values else []
+    rows = [row[:len(headers)] + [''] * (len(headers) - len(row))
+            for row in values[1:]]
+    return pd.DataFrame(rows, columns=headers)
+
+
+def normalize_hours(report):
+    # One row per (User Name, Entry Date, Activity Name), summing the hours of
+    # any duplicate entries. Hours are formatted the same way every time so
+    # unchanged rows compare equal between runs
+    activity = (report['Activity Name'] + report['Time Off Type']).str.strip()
+    report = report.set_index(pd.MultiIndex.from_arrays(
+        [report['User Name'], report['Entry Date'], activity],
+        names=hours_key))
+
+    normalized = report.groupby(level=hours_key, sort=False).first()
+    totals = (report[hours_columns].apply(pd.to_numeric)
+              .groupby(level=hours_key, sort=False).sum())
+    normalized[hours_columns] = totals.apply(lambda s: s.map('{:g}'.format))
+    return normalized
+
+
+def prepare_hours(df):
+    # Stored compactly: names as categoricals (a filter on a user compares
+    # integer codes), Entry Month as an ordered categorical whose int8 codes
+    # are the fiscal month index, and float32 hours
+    df['Entry Date'] = pd.to_datetime(df['Entry Date'])
+    df['Fiscal Year'] = engine.fiscal_years(df['Entry Date'])
+    df['Entry Month'] = engine.fiscal_months(df['Entry Date'])
+    df['Hours Worked'] = (pd.to_numeric(df['Hours Worked'])
+                          + pd.to_numeric(df['Time Off Hrs'])).astype('float32')
+    df['Activity Name'] = combine_names(df['Activity Name'], df['Time Off Type'])
+    df['User Name'] = df['User Name'].astype('category')
+    df.drop(['Time Off Hrs', 'Time Off Type'], axis=1, inplace=True)
+    return df
+
+
+def combine_names(activity, time_off_type):
+    # Activity Name + Time Off Type as a categorical. Activity names are
+    # imported with trailing whitespace, so strip them, working on the distinct
+    # pairs rather than concatenating and stripping every row
+    activity_codes, activities = pd.factorize(activity)
+    type_codes, types = pd.factorize(time_off_type)
+    pair_codes, pairs = pd.factorize(activity_codes * len(types) + type_codes)
+
+    names = (activities[pairs // max(len(types), 1)]
+             + types[pairs % max(len(types), 1)]).str.strip()
+    name_codes, categories = pd.factorize(names)
+    return pd.Categorical.from_codes(name_codes[pair_codes], categories)
+
+
+def prepare_dates(dates):
+    dates['Date'] = pd.to_datetime(dates['Date'])
+    dates['Remaining'] = pd.to_numeric(dates['Remaining'])
+    dates['Month'] = pd.DatetimeIndex(dates['Date']).strftime('%b')
+    dates['Fiscal Year'] = engine.fiscal_years(dates['Date'])
+    return dates
+
+
+def build_months(dates):
+    # Working days (and FTE hours) of each month, by fiscal year
+    months = dates.groupby(['Fiscal Year', 'Month']).max()
+    months['FTE'] = months['Remaining'] * 8
+    return months
+
+
+def prepare_targets(targets):
+    # Planned utilization is entered per month; blank cells become NaN. An
+    # optional Fiscal Year column holds plans for more than one year
+    month_columns = [col for col in targets.columns if col != 'User Name']
+    targets[month_columns] = targets[month_columns].apply(pd.to_numeric,
+                                                          errors='coerce')
+    return targets
+
+
+def year_targets(targets, year):
+    # Planned utilization for one fiscal year; without a Fiscal Year column
+    # the same plan applies to every year
+    if 'Fiscal Year' not in targets:
+        return targets
+    return targets.loc[targets['Fiscal Year'] == year]
+
+
+def prepare_monthly(monthly):
+    numeric = ['Fiscal Year'] + engine.classifications + ['FTE']
+    monthly[numeric] = monthly[numeric].apply(pd.to_numeric)
+    monthly['Last Day'] = pd.to_datetime(monthly['Last Day'])
+    return monthly
+
+
+def fetch_monthly(spreadsheet):
+    # None until data-pipe.py has published the table
+    import gspread
+    try:
+        wks = spreadsheet.worksheet(monthly_title)
+    except gspread.WorksheetNotFound:
+        return None
+    return read_monthly(worksheet_frame(wks))
+
+
+def read_monthly(monthly):
+    # None if the table was published before it had a Fiscal Year
+    if 'Fiscal Year' not in monthly:
+        return None
+    return prepare_monthly(monthly)
+
+
+def write_monthly(spreadsheet, monthly):
+    monthly = monthly.assign(
+        **{'Last Day': monthly['Last Day'].dt.strftime('%Y-%m-%d')})
+    values = [list(monthly.columns)] + monthly.fillna('').values.tolist()
+
+    import gspread
+    try:
+        wks = spreadsheet.worksheet(monthly_title)
+    except gspread.WorksheetNotFound:
+        wks = spreadsheet.add_worksheet(monthly_title, rows=len(values),
+                                        cols=len(monthly.columns))
+    wks.clear()
+    wks.resize(rows=len(values), cols=len(monthly.columns))
+    spreadsheet.values_update(f"'{monthly_title}'!A1",
+                              params={'valueInputOption': 'RAW'},
+                              body={'values': values})
+
+
+def split_years(name, df, previous=None):
+    """Partition a table with a Fiscal Year column into a table per year.
+
+    Keys are snapshot.partition_name(name, year). A partition equal to the
+    one of the same name in `previous` is returned as that same object, so
+    the snapshot keeps its file and stamp.
+    """
+    previous = previous or {}
+    partitions = {}
+    for year, part in df.groupby('Fiscal Year', observed=True):
+        key = snapshot.partition_name(name, year)
+        part = part.reset_index(drop=True)
+        # Only keep the names used in this year
+        for col in ['User Name', 'Activity Name']:
+            if col in part and isinstance(part[col].dtype, pd.CategoricalDtype):
+                part[col] = part[col].cat.remove_unused_categories()
+        if key in previous and previous[key].equals(part):
+            part = previous[key]
+        partitions[key] = part
+    return partitions
+
+
+def replace_monthly(tables, monthly):
+    # Swap in a newly published monthly table, or with None drop every year's
+    # monthly table so with_monthly rebuilds them
+    names = [snapshot.partition_name('monthly', year)
+             for year in snapshot.partitions(tables, 'monthly')]
+    previous = {name: tables.pop(name) for name in names}
+    if monthly is not None:
+        tables.update(split_years('monthly', monthly, previous))
+    return tables
+
+
+def with_monthly(tables):
+    # Build each year's monthly table from the cached hours if it's missing
+    # or stale
+    for year in snapshot.partitions(tables, 'hours'):
+        name = snapshot.partition_name('monthly', year)
+        if tables.get(name) is None:
+            hours = tables[snapshot.partition_name('hours', year)]
+            with timing.stage('build monthly', year=year, rows=len(hours)):
+                tables[name] = engine.build_monthly(
+                    hours, tables['activities'], tables['dates'],
+                    tables['months'])
+    return tables
+
+
+def with_groups(tables):
+    # Roll each year's monthly table up to the NAMES groups, once per refresh
+    # rather than per view. Unchanged roll-ups stay the same objects, so the
+    # snapshot keeps their files
+    for year in snapshot.partitions(tables, 'monthly'):
+        name = snapshot.partition_name('groups', year)
+        with timing.stage('build groups', year=year) as record:
+            groups = engine.build_groups(
+                tables[snapshot.partition_name('monthly', year)],
+                tables['employees'], year_targets(tables['targets'], year))
+            record['rows'] = len(groups)
+        if tables.get(name) is None or not tables[name].equals(groups):
+            tables[name] = groups
+    return tables
+
+
+def read_hours(spreadsheet):
+    # One request for the worksheet list and one for their values. The hours,
+    # the MONTHLY table and the position in the CHANGES log (which the hours
+    # are current through) all come from the same batch get, so they agree
+    worksheets = spreadsheet.worksheets()
+    ids = {wks.title: wks.id for wks in worksheets}
+    ranges = {'hours': range_name(worksheets[0].title)}
+    if monthly_title in ids:
+        ranges['monthly'] = range_name(monthly_title)
+    if changes_title in ids:
+        ranges['changes'] = range_name(changes_title, 'A:A')
+    values = dict(zip(ranges, batch_values(spreadsheet, list(ranges.values()))))
+
+    if 'changes' in values:
+        cursor = pd.DataFrame({'Worksheet': [ids[changes_title]],
+                               'Rows': [len(values['changes']) - 1]})
+    else:
+        cursor = pd.DataFrame({'Worksheet': [-1], 'Rows': [0]})
+    frames = {'hours': values_frame(values['hours']), 'hours_changes': cursor}
+    if 'monthly' in values:
+        frames['monthly'] = values_frame(values['monthly'])
+    return frames
+
+
+def read_inputs(spreadsheet):
+    values = batch_values(spreadsheet, [range_name(title)
+                                        for title in input_titles.values()])
+    return dict(zip(input_titles, map(values_frame, values)))
+
+
+def hours_tables(frames):
+    # Hours as read from any source (strings, as in the sheet), and the
+    # published monthly table and CHANGES cursor if the source has them
+    with timing.stage('prepare hours', rows=len(frames['hours'])):
+        hours = prepare_hours(frames['hours'])
+    monthly = frames.get('monthly')
+    tables = {'hours': hours,
+              'monthly': None if monthly is None else read_monthly(monthly)}
+    if 'hours_changes' in frames:
+        tables['hours_changes'] = frames['hours_changes']
+    return tables
+
+
+def input_tables(frames):
+    dates = prepare_dates(frames['dates'])
+    return {'activities': frames['activities'],
+            'dates': dates,
+            'calendar': engine.Calendar.from_dates(dates).to_frame(),
+            'months': build_months(dates),
+            'employees': frames['employees'],
+            'targets': prepare_targets(frames['targets'])}
+
+
+def fetch_hours(spreadsheet):
+    return hours_tables(read_hours(spreadsheet))
+
+
+def fetch_inputs(spreadsheet):
+    return input_tables(read_inputs(spreadsheet))
+
+
+def fetch_both(client, fetch_hours_tables, fetch_inputs_tables):
+    # Open and read the two spreadsheets at the same time, so a cold start
+    # waits about as long as the slower of them rather than for both
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        hours = executor.submit(lambda: fetch_hours_tables(client.open(hours_title)))
+        inputs = executor.submit(lambda: fetch_inputs_tables(client.open(inputs_title)))
+        return hours.result(), inputs.result()
+
+
+def read_frames(client):
+    # Every raw table, in the same form as the other sources (see sources.py)
+    with timing.stage('fetch sheets'):
+        frames, inputs = fetch_both(client, read_hours, read_inputs)
+    frames.update(inputs)
+    return frames
+
+
+def prepare_tables(frames):
+    # Hours and monthly tables are stored a fiscal year per table, so views
+    # of one year never load the others
+    tables = hours_tables(frames)
+    tables.update(input_tables(frames))
+    tables.update(split_years('hours', tables.pop('hours')))
+    return with_groups(with_monthly(replace_monthly(tables, tables.pop('monthly'))))
+
+
+def fetch_tables(client):
+    return prepare_tables(read_frames(client))
+
+
+def replace_inputs(tables, inputs):
+    # New input tables invalidate every monthly table built from them
+    tables.update(inputs)
+    return replace_monthly(tables, None)
+
+
+def read_changes(spreadsheet, cursor):
+    # Rows added to the CHANGES log since the cursor. Returns None if the log
+    # was replaced by a full upload, in which case the hours must be reloaded
+    import gspread
+    try:
+        wks = spreadsheet.worksheet(changes_title)
+    except gspread.WorksheetNotFound:
+        return None
+    if wks.id != int(cursor.at[0, 'Worksheet']):
+        return None
+
+    applied = int(cursor.at[0, 'Rows'])
+    header = wks.row_values(1)
+    rows = []
+    if wks.row_count >= applied + 2:
+        rows = wks.get(f'{applied + 2}:{wks.row_count}')
+    rows = [row + [''] * (len(header) - len(row)) for row in rows]
+
+    changes = pd.DataFrame(rows, columns=header)
+    cursor = pd.DataFrame({'Worksheet': [wks.id], 'Rows': [applied + len(rows)]})
+    return changes, cursor
+
+
+def merge_hours(hours, changes):
+    # Apply logged changes (already through prepare_hours) to an hours table,
+    # or to None for a year without hours yet: drop every row with a changed
+    # key, then add back the latest version of the ones that were upserted
+    changes = changes.drop_duplicates(hours_key, keep='last')
+    upserts = changes.loc[changes['Change'] == 'upsert'].drop('Change', axis=1)
+    if hours is None:
+        hours = upserts.iloc[:0]
+
+    changed = pd.MultiIndex.from_frame(changes[hours_key])
+    keep = ~pd.MultiIndex.from_frame(hours[hours_key]).isin(changed)
+
+    # Concatenating categoricals with different categories gives object
+    # columns, so convert the names back
+    hours = pd.concat([hours.loc[keep], upserts], ignore_index=True)
+    return hours.astype({'User Name': 'category', 'Activity Name': 'category'})
+
+
+def update_tables(client, tables, previous, current):
+    # Bring snapshot tables up to date with only the spreadsheets that changed,
+    # merging new hours from the CHANGES log rather than reloading them all.
+    # Returns None when a full fetch is needed instead
+    tables = dict(tables)
+
+    if previous.get(hours_title) != current.get(hours_title):
+        if 'hours_changes' not in tables:
+            return None
+        spreadsheet = client.open(hours_title)
+        changes = read_changes(spreadsheet, tables['hours_changes'])
+        if changes is None:
+            return None
+        changes, tables['hours_changes'] = changes
+
+        # Only the years with changes get new tables
+        with timing.stage('merge hours', rows=len(changes)):
+            changes = prepare_hours(changes)
+            for year, year_changes in changes.groupby('Fiscal Year',
+                                                      observed=True):
+                name = snapshot.partition_name('hours', year)
+                tables[name] = merge_hours(tables.get(name), year_changes)
+        replace_monthly(tables, fetch_monthly(spreadsheet))
+
+    if previous.get(inputs_title) != current.get(inputs_title):
+        replace_inputs(tables, fetch_inputs(client.open(inputs_title)))
+
+    return with_groups(with_monthly(tables))
+
+
+def spreadsheet_version(spreadsheet):
+    try:
+        # Modified time from the Drive API
+        return spreadsheet.lastUpdateTime
+    except AttributeError:
+        # Older gspread: fall back to the size of each worksheet
+        return [[wks.title, wks.row_count, wks.col_count]
+                for wks in spreadsheet.worksheets()]
+
+
+def source_version(client):
+    # Cheap check of whether either source spreadsheet has changed
+    with timing.stage('check source version'):
+        versions = fetch_both(client, spreadsheet_version, spreadsheet_version)
+    return dict(zip([hours_title, inputs_title], versions))
@@ -0,0 +1,146 @@
+import json
+import os
+import time
+
+import pandas as pd
+
+import timing
+
+script_path = os.path.abspath(__file__)
+root_path = os.path.dirname(os.path.dirname(script_path))
+snapshot_path = os.path.join(root_path, 'data', 'snapshot')
+
+# Seconds to serve the snapshot before checking the source for changes
+ttl = int(os.environ.get('SNAPSHOT_TTL', 15 * 60))
+
+# Bumped when the set of tables changes; older snapshots are fetched again
+layout = 7
+
+
+def meta_path(path):
+    return os.path.join(path, 'meta.json')
+
+
+def table_path(path, name):
+    return os.path.join(path, f'{name}.parquet')
+
+
+def read_meta(path=snapshot_path):
+    try:
+        with open(meta_path(path)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('layout') != layout:
+        return None
+    if not all(os.path.exists(table_path(path, name)) for name in meta['tables']):
+        return None
+    return meta
+
+
+def write_meta(meta, path=snapshot_path):
+    tmp = meta_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path(path))
+
+
+def read_table(name, path=snapshot_path):
+    with timing.stage('read snapshot table', table=name) as record:
+        df = pd.read_parquet(table_path(path, name))
+        record['rows'] = len(df)
+    return df
+
+
+def read(path=snapshot_path, meta=None):
+    meta = meta or read_meta(path)
+    return {name: read_table(name, path) for name in meta['tables']}
+
+
+def partition_name(name, year):
+    # Tables partitioned by fiscal year are stored as one table per year
+    return f'{name}_{year}'
+
+
+def partitions(names, name):
+    # Fiscal years of the `name` partitions among the table names (or a dict
+    # keyed by them, like stamps()), oldest first
+    prefix = name + '_'
+    return sorted(int(key[len(prefix):]) for key in names
+                  if key.startswith(prefix) and key[len(prefix):].isdigit())
+
+
+def stamps(path=snapshot_path):
+    # When each table was last written, to key caches of individual tables
+    meta = read_meta(path)
+    return meta['tables'] if meta else {}
+
+
+def write(tables, version, path=snapshot_path, unchanged=None):
+    # Write each table next to its final name and swap it in, then the
+    # metadata last, so a reader never sees a half-written file. Tables that
+    # are the same objects as in `unchanged` keep their files and stamps
+    os.makedirs(path, exist_ok=True)
+    now = time.time()
+    previous = read_meta(path) if unchanged else None
+    table_stamps = {}
+    for name, df in tables.items():
+        if previous and name in previous['tables'] and df is unchanged.get(name):
+            table_stamps[name] = previous['tables'][name]
+            continue
+        with timing.stage('write snapshot table', table=name, rows=len(df)):
+            tmp = table_path(path, name) + '.tmp'
+            df.to_parquet(tmp)
+            os.replace(tmp, table_path(path, name))
+        table_stamps[name] = now
+
+    write_meta({'layout': layout,
+                'tables': table_stamps,
+                'version': version,
+                'fetched': now,
+                'checked': now}, path)
+
+
+def refresh(fetch, version, update=None, path=snapshot_path, ttl=ttl):
+    """Bring the snapshot up to date, refetching only when the source changed.
+
+    Within `ttl` seconds of the last check the local files are left as is.
+    After that `version()` is compared with the version the snapshot was taken
+    at, and the source is only read again if they differ: through
+    `update(tables, previous, current)` when given, which returns the updated
+    tables (or None if it can't), otherwise through `fetch()`.
+
+    Returns the new tables if the snapshot was rewritten, otherwise None.
+    """
+    meta = read_meta(path)
+    if meta is not None and time.time() - meta['checked'] < ttl:
+        timing.count('snapshot', 'fresh')
+        return None
+
+    current = version()
+    if meta is not None and current == meta['version']:
+        timing.count('snapshot', 'unchanged')
+        meta['checked'] = time.time()
+        write_meta(meta, path)
+        return None
+
+    if meta is not None and update is not None:
+        previous = read(path, meta)
+        with timing.stage('update snapshot'):
+            tables = update(previous, meta['version'], current)
+        if tables is not None:
+            timing.count('snapshot', 'updated')
+            write(tables, current, path, unchanged=previous)
+            return tables
+
+    timing.count('snapshot', 'fetched')
+    with timing.stage('fetch snapshot'):
+        tables = fetch()
+    write(tables, current, path)
+    return tables
+
+
+def load(fetch, version, update=None, path=snapshot_path, ttl=ttl):
+    # Return all the snapshot tables, refreshed as in refresh()
+    tables = refresh(fetch, version, update, path, ttl)
+    return tables if tables is not None else read(path)
@@ -0,0 +1,423 @@
+import argparse
+import contextlib
+import functools
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import engine
+import sheets
+import snapshot
+import timing
+
+script_path = os.path.abspath(__file__)
+root_path = os.path.dirname(os.path.dirname(script_path))
+folder_path = os.path.join(root_path, 'data')
+
+# Hours files the file source reads from its folder, when present: the daily
+# Replicon report saved by data-pipe.py and the output of read_deltek.py
+hours_files = ['Utilization Report Daily.csv', 'paste_into_google_sheet.csv']
+
+database_path = os.path.join(folder_path, 'utilization.db')
+
+class Source:
+    """Where the hours and input tables come from.
+
+    A source reads the raw tables with read_hours() and read_inputs(), and
+    says whether they changed with version(). The rest (preparing the tables,
+    partitioning them by fiscal year and building the monthly tables and
+    roll-ups) is the same for every source.
+    """
+
+    name = None
+
+    def read_hours(self):
+        raise NotImplementedError
+
+    def read_inputs(self):
+        raise NotImplementedError
+
+    def version(self):
+        raise NotImplementedError
+
+    def read_frames(self):
+        frames = self.read_hours()
+        frames.update(self.read_inputs())
+        return frames
+
+    def fetch_tables(self):
+        return sheets.prepare_tables(self.read_frames())
+
+    def update_tables(self, tables, previous, current):
+        # When only the inputs changed, keep the prepared hours and rebuild
+        # what depends on the inputs. Otherwise fetch everything again
+        if previous['hours'] != current['hours']:
+            return None
+        tables = dict(tables)
+        sheets.replace_inputs(tables, sheets.input_tables(self.read_inputs()))
+        return sheets.with_groups(sheets.with_monthly(tables))
+
+
+class SheetsSource(Source):
+    # Google Sheets (or the offline mock with MOCK_SHEETS), authorizing on
+    # first use
+    name = 'sheets'
+
+    def __init__(self, client=None):
+        self.client = client
+
+    def connect(self):
+        if self.client is None:
+            self.client = sheets.authorize()
+        return self.client
+
+    def read_hours(self):
+        return sheets.read_hours(self.connect().open(sheets.hours_title))
+
+    def read_inputs(self):
+        return sheets.read_inputs(self.connect().open(sheets.inputs_title))
+
+    def read_frames(self):
+        return sheets.read_frames(self.connect())
+
+    def version(self):
+        return sheets.source_version(self.connect())
+
+    def update_tables(self, tables, previous, current):
+        # Merges new hours from the CHANGES log
+        return sheets.update_tables(self.connect(), tables, previous, current)
+
+
+class FileSource(Source):
+    """Local files in `folder`, without going through Google Sheets.
+
+    Hours are read from the hours_files there (the Replicon report and the
+    read_deltek.py output) and the inputs from Utilization-Inputs.xlsx, with a
+    worksheet per input, or else from Utilization-Inputs/<worksheet>.csv.
+    Only the hours rows that pass validate.validate_hours are kept, as
+    data-pipe.py does before publishing, so they depend on the inputs too.
+    """
+
+    name = 'files'
+
+    def __init__(self, folder=folder_path):
+        self.folder = folder
+
+    def hours_paths(self):
+        paths = [os.path.join(self.folder, name) for name in hours_files]
+        return [path for path in paths if os.path.exists(path)]
+
+    def workbook_path(self):
+        return os.path.join(self.folder, sheets.inputs_title + '.xlsx')
+
+    def input_path(self, title):
+        return os.path.join(self.folder, sheets.inputs_title, title + '.csv')
+
+    def input_paths(self):
+        if os.path.exists(self.workbook_path()):
+            return [self.workbook_path()]
+        return [self.input_path(title) for title in sheets.input_titles.values()]
+
+    def read_hours(self, inputs=None):
+        # validate imports this module, so it's imported on first use
+        import validate
+
+        paths = self.hours_paths()
+        if not paths:
+            raise FileNotFoundError(
+                f'No hours files ({", ".join(hours_files)}) in {self.folder}')
+        if inputs is None:
+            inputs = self.read_inputs()
+        hours = pd.concat([read_hours_file(path) for path in paths],
+                          ignore_index=True)
+        hours, _, _ = validate.validate_hours(hours, inputs['activities'],
+                                              inputs['dates'])
+        return {'hours': sheets.normalize_hours(hours).reset_index(drop=True)}
+
+    def read_inputs(self):
+        if os.path.exists(self.workbook_path()):
+            workbook = pd.read_excel(self.workbook_path(),
+                                     sheet_name=list(sheets.input_titles.values()),
+                                     dtype=str)
+            return {name: workbook[title].fillna('')
+                    for name, title in sheets.input_titles.items()}
+        return {name: pd.read_csv(self.input_path(title), dtype=str,
+                                  keep_default_na=False)
+                for name, title in sheets.input_titles.items()}
+
+    def read_frames(self):
+        # Read the inputs once, for validating the hours as well
+        frames = self.read_inputs()
+        frames.update(self.read_hours(frames))
+        return frames
+
+    def version(self):
+        return {'hours': file_versions(self.hours_paths() + self.input_paths()),
+                'inputs': file_versions(self.input_paths())}
+
+    def write_frames(self, frames):
+        # Write the hours as the Replicon report and the inputs as CSV files
+        os.makedirs(os.path.join(self.folder, sheets.inputs_title), exist_ok=True)
+        if 'hours' in frames:
+            frames['hours'].to_csv(os.path.join(self.folder, hours_files[0]),
+                                   index=False)
+        for name, title in sheets.input_titles.items():
+            if name in frames:
+                frames[name].to_csv(self.input_path(title), index=False)
+
+
+class SqliteSource(Source):
+    """A local SQLite store of the hours and inputs.
+
+    The inputs are kept as text tables like the worksheets. Hours are kept as
+    entries with their fiscal year and month and their classification looked
+    up from the activities, indexed so the monthly sums and each user's first
+    and last days come from GROUP BY queries. Loading the tables never reads
+    the individual entries into memory, however much history there is.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path=database_path):
+        self.path = path
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        for statement in schema + indexes:
+            connection.execute(statement)
+        return connection
+
+    def read_table(self, connection, name):
+        return pd.read_sql_query(f'SELECT * FROM "{name}"', connection,
+                                 dtype=str)
+
+    def read_hours(self):
+        # The entries in the columns of the hours report, with the time off
+        # type already part of the activity name
+        with contextlib.closing(self.connect()) as connection:
+            hours = pd.read_sql_query(hours_query, connection, dtype=str)
+        hours['Entry Date'] = pd.to_datetime(hours['Entry Date']).dt.strftime('%m/%d/%Y')
+        hours['Time Off Hrs'] = '0'
+        hours['Time Off Type'] = ''
+        return {'hours': hours}
+
+    def read_inputs(self):
+        with contextlib.closing(self.connect()) as connection:
+            return {name: self.read_table(connection, name)
+                    for name in sheets.input_titles}
+
+    def read_monthly(self, dates, months):
+        with contextlib.closing(self.connect()) as connection:
+            with timing.stage('sum hours', source=self.name) as record:
+                sums = pd.read_sql_query(sums_query, connection)
+                days = pd.read_sql_query(days_query, connection,
+                                         parse_dates=['First Day', 'Last Day'])
+                record['rows'] = len(sums)
+        # Same dtypes as from the hours table
+        sums['Entry Month'] = np.array(engine.list_months)[sums['Entry Month']]
+        for df in [sums, days]:
+            df['Fiscal Year'] = df['Fiscal Year'].astype('Int16')
+        with timing.stage('build monthly', source=self.name, rows=len(sums)):
+            return engine.summarize_monthly(sums, days, dates, months)
+
+    def version(self):
+        # Every write replaces the tables, so the file's modified time and
+        # size are enough to tell whether anything changed
+        return {'hours': file_versions([self.path]),
+                'inputs': file_versions([self.path])}
+
+    def fetch_tables(self):
+        return self.update_tables({}, None, None)
+
+    def update_tables(self, tables, previous, current):
+        # Summing in SQLite is cheap, so build every table again, keeping
+        # the unchanged ones as they were so the snapshot keeps their files
+        new = sheets.input_tables(self.read_inputs())
+        new.update(sheets.split_years(
+            'monthly', self.read_monthly(new['dates'], new['months']), tables))
+        new.update({name: tables[name] for name in tables
+                    if name.startswith('groups_') and name.replace(
+                        'groups_', 'monthly_', 1) in new})
+        return sheets.with_groups(new)
+
+    def write_frames(self, frames):
+        # Replace the inputs and hours given, classifying the entries against
+        # the activities then stored
+        with contextlib.closing(self.connect()) as connection, connection:
+            for name in sheets.input_titles:
+                if name in frames:
+                    frames[name].astype(str).to_sql(
+                        name, connection, if_exists='replace', index=False)
+            if 'hours' in frames:
+                self.write_entries(connection, frames['hours'])
+            elif 'activities' in frames:
+                connection.execute(classify_entries)
+
+    def write_entries(self, connection, hours):
+        with timing.stage('write entries', source=self.name,
+                          rows=len(hours)):
+            # Every entry would be classified 'Billable' without them
+            activities = self.read_table(connection, 'activities')
+            if activities.empty:
+                raise ValueError(f'No activities in {self.path} to classify '
+                                 'the hours against; write the inputs first '
+                                 'or with them')
+            hours = sheets.prepare_hours(hours.copy())
+            columns = [
+                hours['User Name'].astype(str).tolist(),
+                hours['Entry Date'].dt.strftime('%Y-%m-%d').tolist(),
+                hours['Fiscal Year'].astype(int).tolist(),
+                hours['Entry Month'].cat.codes.astype(int).tolist(),
+                hours['Activity Name'].astype(str).tolist(),
+                engine.classify(hours, activities).tolist(),
+                hours['Hours Worked'].astype(float).round(2).tolist()]
+
+            # Bulk load without the indexes, then build them once
+            connection.execute('DELETE FROM entries')
+            for name in ['entries_by_month', 'entries_by_day']:
+                connection.execute(f'DROP INDEX IF EXISTS {name}')
+            connection.executemany(
+                'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                zip(*columns))
+            for statement in indexes:
+                connection.execute(statement)
+
+
+# Hours entries, with the fiscal month from 0 for April. The activities
+# table is replaced by the first write of the inputs, and entries can't be
+# written until it has some
+schema = [
+    """CREATE TABLE IF NOT EXISTS activities (
+        "Activity Name" TEXT,
+        "Classification" TEXT)""",
+    """CREATE TABLE IF NOT EXISTS entries (
+        user_name TEXT NOT NULL,
+        entry_date TEXT NOT NULL,
+        fiscal_year INTEGER NOT NULL,
+        fiscal_month INTEGER NOT NULL,
+        activity_name TEXT NOT NULL,
+        classification TEXT NOT NULL,
+        hours REAL NOT NULL)"""]
+
+# Covering indexes for the monthly sums (by fiscal year, user, fiscal month
+# and classification) and for each user's first and last days
+indexes = [
+    """CREATE INDEX IF NOT EXISTS entries_by_month ON entries
+        (fiscal_year, user_name, fiscal_month, classification, hours)""",
+    """CREATE INDEX IF NOT EXISTS entries_by_day ON entries
+        (fiscal_year, user_name, entry_date, activity_name)"""]
+
+# Materialize the classification of every entry, as engine.classify does:
+# the first matching activity, and 'Billable' for activities not listed
+classify_entries = """
+UPDATE entries SET classification = COALESCE(
+    (SELECT "Classification" FROM activities
+     WHERE activities."Activity Name" = entries.activity_name
+     ORDER BY activities.rowid LIMIT 1),
+    'Billable')
+"""
+
+sums_query = """
+SELECT fiscal_year AS "Fiscal Year", user_name AS "User Name",
+       fiscal_month AS "Entry Month", classification AS "Classification",
+       SUM(hours) AS "Hours Worked"
+FROM entries
+GROUP BY fiscal_year, user_name, fiscal_month, classification
+"""
+
+days_query = """
+SELECT fiscal_year AS "Fiscal Year", user_name AS "User Name",
+       MIN(entry_date) AS "First Day",
+       MAX(CASE WHEN activity_name != 'Holiday' THEN entry_date END) AS "Last Day"
+FROM entries
+GROUP BY fiscal_year, user_name
+"""
+
+hours_query = """
+SELECT user_name AS "User Name", entry_date AS "Entry Date",
+       activity_name AS "Activity Name", hours AS "Hours Worked"
+FROM entries
+"""
+
+
+def read_hours_file(path):
+    # The Replicon report and read_deltek.py output share the hours columns,
+    # but read_deltek.py has no Time Off Type and writes ISO dates
+    hours = pd.read_csv(path, dtype=str, keep_default_na=False)
+    # Dates that don't parse are left as they are, for validation to catch
+    entry_date = pd.to_datetime(hours['Entry Date'], errors='coerce')
+    hours['Entry Date'] = (entry_date.dt.strftime('%m/%d/%Y')
+                           .where(entry_date.notna(), hours['Entry Date']))
+    if 'Time Off Type' not in hours:
+        hours['Time Off Type'] = ''
+    return hours
+
+
+def file_versions(paths):
+    versions = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        versions.append([path, stat.st_mtime_ns, stat.st_size])
+    return versions
+
+
+sources = {SheetsSource.name: SheetsSource,
+           FileSource.name: FileSource,
+           SqliteSource.name: SqliteSource}
+
+
+def open_source(spec=None):
+    """The data source named by `spec`, or by $DATA_SOURCE (default 'sheets').
+
+    `spec` is 'sheets', 'files' or 'sqlite', optionally followed by a colon
+    and the folder (files) or database (sqlite) to read instead of the ones
+    in data/, e.g. 'sqlite:/srv/utilization.db'.
+    """
+    spec = spec or os.environ.get('DATA_SOURCE', SheetsSource.name)
+    name, _, location = spec.partition(':')
+    if name not in sources:
+        raise ValueError(f"Unknown data source '{name}' "
+                         f"(expected one of {', '.join(sources)})")
+    return sources[name](location) if location else sources[name]()
+
+
+def update_tables(source, tables, previous, current):
+    # A snapshot taken from another kind of source is fetched again
+    if previous.get('source') != current.get('source'):
+        return None
+    return source.update_tables(tables, previous, current)
+
+
+def version(source):
+    return dict(source.version(), source=source.name)
+
+
+def sync_snapshot(source):
+    # Bring the local snapshot up to date with the source, only going back to
+    # it once the snapshot is stale and the source has changed
+    return snapshot.refresh(source.fetch_tables,
+                            functools.partial(version, source),
+                            functools.partial(update_tables, source))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Copy the raw hours and input tables from one data source '
+                    'to another, e.g. Google Sheets to a local SQLite database')
+    parser.add_argument('--from', dest='source', default=SheetsSource.name,
+                        help="source to read: 'sheets', 'files[:<folder>]' "
+                             "or 'sqlite[:<path>]'")
+    parser.add_argument('--to', dest='destination',
+                        default=f'{SqliteSource.name}:{database_path}',
+                        help="'files[:<folder>]' or 'sqlite[:<path>]'")
+    args = parser.parse_args()
+
+    frames = open_source(args.source).read_frames()
+    open_source(args.destination).write_frames(frames)
+    print (f"Copied {len(frames['hours'])} hours rows from {args.source} "
+           f"to {args.destination}")
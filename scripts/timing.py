@@ -0,0 +1,82 @@
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+# Structured (one JSON object per line) log of every timed stage and cache
+# event. Set PERF_LOG_LEVEL=WARNING to silence it
+logger = logging.getLogger('utilization.timing')
+logger.setLevel(os.environ.get('PERF_LOG_LEVEL', 'INFO'))
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+# Process-wide totals for the debug panel
+lock = threading.Lock()
+stages = collections.OrderedDict()
+counters = collections.OrderedDict()
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """Time a block of work, logging and totalling it under `name`.
+
+    Yields a dict the block can add fields to, e.g. record['rows'] = len(df).
+    """
+    record = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        with lock:
+            totals = stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            totals['last seconds'] = seconds
+            totals['last rows'] = record.get('rows')
+        logger.info(json.dumps(dict({'event': 'stage', 'stage': name,
+                                     'seconds': round(seconds, 6)}, **record),
+                               default=str))
+
+
+def timed(name):
+    # Decorator form of stage() for whole functions
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, event):
+    # Count cache events, e.g. count('render_report', 'miss')
+    with lock:
+        events = counters.setdefault(name, collections.Counter())
+        events[event] += 1
+    logger.info(json.dumps({'event': 'count', 'name': name, 'type': event}))
+
+
+def stage_summary():
+    with lock:
+        rows = [dict({'stage': name}, **totals) for name, totals in stages.items()]
+    summary = pd.DataFrame(rows, columns=['stage', 'calls', 'seconds',
+                                          'last seconds', 'last rows'])
+    summary['mean seconds'] = summary['seconds'] / summary['calls']
+    return summary.set_index('stage')
+
+
+def counter_summary():
+    with lock:
+        rows = [dict({'name': name}, **events) for name, events in counters.items()]
+    return pd.DataFrame(rows).set_index('name').fillna(0).astype(int) if rows else pd.DataFrame()
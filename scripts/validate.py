@@ -0,0 +1,146 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import engine
+import ingest
+import sheets
+import sources
+import timing
+
+script_path = os.path.abspath(__file__)
+root_path = os.path.dirname(os.path.dirname(script_path))
+folder_path = os.path.join(root_path, 'data')
+
+# Rows of the last report that failed a check, with the checks they failed
+quarantine_path = os.path.join(folder_path, 'hours_quarantine.csv')
+
+# Most hours (worked and time off) one person can log on one day
+max_daily_hours = float(os.environ.get('MAX_DAILY_HOURS', 24))
+
+# Checks, in the order they're reported
+problems = ['missing user', 'bad date', 'bad hours', 'unknown activity',
+            'duplicate entry', 'outside fiscal years', 'over daily hours']
+
+# Checks that are only counted: repeated entries are summed (see
+# sheets.normalize_hours), since people do log the same hours twice a day
+warnings = ['duplicate entry']
+
+
+def validate_hours(report, activities, dates, max_hours=max_daily_hours):
+    """Check every row of the hours report at once.
+
+    `report` is the Replicon report as read (strings), and `activities` and
+    `dates` the ACTIVITY and DATES worksheets. Returns the rows that pass
+    every check but the warnings, the rows that don't (with a Problem column
+    listing the checks they failed) and a summary of the counts. Blank hours
+    are 0 in the clean rows, so they always parse.
+    """
+    with timing.stage('validate hours', rows=len(report)) as record:
+        checks = {}
+        checks['missing user'] = (report['User Name'].str.strip() == '').to_numpy()
+
+        entry_date = pd.to_datetime(report['Entry Date'], errors='coerce')
+        checks['bad date'] = entry_date.isna().to_numpy()
+
+        hours, numbers = zip(*[parse_hours(report[column])
+                               for column in sheets.hours_columns])
+        hours = dict(zip(sheets.hours_columns, hours))
+        numbers = np.column_stack(numbers)
+        checks['bad hours'] = ~(np.isfinite(numbers) & (numbers >= 0)).all(axis=1)
+
+        # Look up each distinct activity once (a missing one, code -1, is
+        # unknown)
+        activity = (report['Activity Name'] + report['Time Off Type']).str.strip()
+        codes, names = pd.factorize(activity)
+        known = np.append(names.isin(activities['Activity Name'].str.strip()),
+                          False)
+        checks['unknown activity'] = ~known[codes]
+
+        checks['duplicate entry'] = report.duplicated(keep='first').to_numpy()
+
+        years = engine.fiscal_years(pd.to_datetime(dates['Date']))
+        checks['outside fiscal years'] = (
+            ~checks['bad date']
+            & ~engine.fiscal_years(entry_date).isin(years.unique()).to_numpy(
+                dtype=bool, na_value=False))
+
+        # Daily totals only count rows that are otherwise fine
+        counted = ~np.logical_or.reduce(
+            [checks[problem] for problem in checks if problem not in warnings])
+        day_hours = (pd.Series(np.where(counted, numbers.sum(axis=1), 0))
+                     .groupby([report['User Name'].to_numpy(),
+                               entry_date.to_numpy()], dropna=False)
+                     .transform('sum').to_numpy())
+        checks['over daily hours'] = counted & (day_hours > max_hours)
+
+        failed = ~counted | checks['over daily hours']
+        clean = report.loc[~failed].assign(**{
+            column: values[~failed] for column, values in hours.items()})
+
+        quarantined = report.loc[failed].copy()
+        labels = np.array([''] * failed.sum(), dtype=object)
+        for problem in problems:
+            if problem in warnings:
+                continue
+            labels = labels + np.where(checks[problem][failed], problem + '; ', '')
+        quarantined['Problem'] = [label[:-2] for label in labels]
+
+        summary = {'rows': len(report), 'clean': len(clean),
+                   'quarantined': len(quarantined)}
+        summary.update({problem: int(checks[problem].sum())
+                        for problem in problems})
+        record.update(summary)
+    return clean, quarantined, summary
+
+
+def parse_hours(column):
+    # Hours as strings (blank as '0') and as numbers (NaN where they don't
+    # parse), parsing each distinct value once
+    codes, values = pd.factorize(column)
+    values = pd.Series(values).where(values.str.strip() != '', '0')
+    numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+    return values.to_numpy()[codes], numbers[codes]
+
+
+def write_quarantine(quarantined, path=quarantine_path):
+    # Replaced every run (emptied when nothing failed), so it only ever lists
+    # the last report's problems
+    tmp = path + '.tmp'
+    quarantined.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def describe(summary, path=quarantine_path):
+    def counts(names):
+        return ', '.join(f'{name}: {summary[name]}' for name in names
+                         if summary[name])
+
+    message = (f"Validated {summary['rows']} rows: {summary['clean']} clean, "
+               f"{summary['quarantined']} quarantined")
+    failed = counts([problem for problem in problems if problem not in warnings])
+    if failed:
+        message += f' in {path} ({failed})'
+    if counts(warnings):
+        message += f'. Kept ({counts(warnings)})'
+    return message
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check the Replicon report and list the rows that fail')
+    parser.add_argument('report', nargs='?', default=ingest.report_path)
+    parser.add_argument('--source', default=None,
+                        help="where to read ACTIVITY and DATES from, e.g. "
+                             "'sheets' or 'files:<folder>' (see sources.py)")
+    parser.add_argument('-o', '--output', default=quarantine_path)
+    args = parser.parse_args()
+
+    inputs = sources.open_source(args.source).read_inputs()
+    report = pd.read_csv(args.report, dtype=str, keep_default_na=False)
+    _, quarantined, summary = validate_hours(report, inputs['activities'],
+                                             inputs['dates'])
+    write_quarantine(quarantined, args.output)
+    print (describe(summary, args.output))
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+import engine
+
+
+def dates_table(start, end):
+    # The DATES sheet: every working day with the working days left in its
+    # month, counting itself
+    days = pd.bdate_range(start, end)
+    dates = pd.DataFrame({'Date': days})
+    dates['Remaining'] = (dates.groupby(days.strftime('%Y-%m'))
+                          .cumcount(ascending=False) + 1)
+    return dates
+
+
+def test_month_end_weekend_stays_in_its_month():
+    # Saturday 2019-08-31 follows the last working day of August; September
+    # has 21 working days
+    dates = dates_table('2019-08-01', '2019-09-30')
+    calendar = engine.Calendar.from_frame(
+        engine.Calendar.from_dates(dates).to_frame())
+    days = ['2019-08-30', '2019-08-31', '2019-09-01', '2019-09-02']
+
+    for table in (dates, calendar):
+        np.testing.assert_array_equal(
+            engine.remaining_days(table, days), [1, 0, 21, 21])
+        np.testing.assert_array_equal(
+            engine.days_left(table, days), [0, 0, 21, 20])
+
+
+def test_weekend_before_a_month_starts_working():
+    # Thursday 2019-08-01 is August's first working day; the weekend after
+    # it has 20 working days left
+    dates = dates_table('2019-08-01', '2019-09-30')
+    days = ['2019-08-01', '2019-08-03', '2019-08-04', '2019-07-31']
+
+    np.testing.assert_array_equal(
+        engine.remaining_days(dates, days), [22, 20, 20, np.nan])
+    np.testing.assert_array_equal(
+        engine.days_left(dates, days), [21, 20, 20, np.nan])
+
+
+def test_company_column_is_its_own_grouping():
+    monthly = pd.DataFrame({
+        'User Name': ['Ann', 'Bob'],
+        'Entry Month': ['Apr', 'Apr'],
+        'Billable': [80.0, 40.0], 'R&D': 0.0, 'Other': 0.0, 'Time Off': 0.0,
+        'FTE': [160.0, 160.0],
+        'Last Day': pd.to_datetime(['2019-04-30', '2019-04-30'])})
+    employees = pd.DataFrame({'User Name': ['Ann', 'Bob'],
+                              'Company': ['Acme', 'Beta']})
+
+    groups = engine.build_groups(monthly, employees)
+    april = groups.loc[groups['Entry Month'] == 'Apr'].set_index(
+        ['Dimension', 'Group'])['Billable']
+
+    assert april.to_dict() == {('Company', 'Acme'): 80.0,
+                               ('Company', 'Beta'): 40.0,
+                               (engine.company, 'All'): 120.0}
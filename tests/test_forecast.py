@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import engine
+import forecast
+import report
+import sheets
+
+# A 20 working day month: 160 FTE hours
+fte = np.full((1, 12), 160.0)
+
+
+def test_every_method():
+    # Apr 0.9, May 0.625 and 60 hours in Jun with 5 working days left, so
+    # 0.5 of the 120 hours to date. Hours to date are 144 + 100 + 80 = 324
+    # over 480
+    billable = np.zeros((1, 12))
+    billable[0, :3] = [144, 100, 60]
+    planned = np.full((1, 12), 112.0)
+    planned[0, 9:] = np.nan
+
+    result = forecast.forecast(billable, fte, [2], [5], planned_hours=planned,
+                               provided=0.8)
+
+    assert list(result.rates) == forecast.methods
+    assert result.utilization[0, 2] == pytest.approx(60 / 160)
+    assert result.util_to_date[0, 2] == pytest.approx(0.5)
+    np.testing.assert_allclose(result.predicted_hours['Month to Date'][0, :4],
+                               [144, 100, 80, 80])
+
+    rest = 9 * 160
+    expected = {
+        'Month to Date': (324 + 0.5 * rest) / 1920,
+        'Last Month': (324 + 0.625 * rest) / 1920,
+        'Year (Semester) to Date': (324 + 324 / 480 * rest) / 1920,
+        # 0.7 planned through Dec, then the year to date rate
+        'Planned': (324 + 6 * 112 + 3 * 160 * 324 / 480) / 1920,
+        'Provided Rate': (324 + 0.8 * rest) / 1920,
+    }
+    for method, utilization in expected.items():
+        assert result.predicted_utilization[method][0, -1] == pytest.approx(
+            utilization), method
+
+
+def test_optional_methods_left_out():
+    result = forecast.forecast(np.full((1, 12), 80.0), fte, [0], [0])
+    assert list(result.rates) == forecast.methods[:3]
+
+
+def test_planned_without_a_plan_is_year_to_date():
+    billable = np.zeros((1, 12))
+    billable[0, :3] = [144, 100, 60]
+    result = forecast.forecast(billable, fte, [2], [5],
+                               planned_hours=np.full((1, 12), np.nan))
+    np.testing.assert_allclose(result.predicted_utilization['Planned'],
+                               result.predicted_utilization['Year (Semester) to Date'])
+
+
+def test_first_month_last_month_is_month_to_date():
+    billable = np.zeros((1, 12))
+    billable[0, 0] = 60
+    result = forecast.forecast(billable, fte, [0], [5])
+    assert result.rates['Last Month'][0, 0] == pytest.approx(0.5)
+
+
+def test_by_semester():
+    # 0.5 through the first semester (Apr-Oct), Nov 0.8 and 60 hours in Dec
+    # with 5 working days left, so 80 hours to date
+    billable = np.zeros((1, 12))
+    billable[0, :9] = [80] * 7 + [128, 60]
+
+    by_year = forecast.forecast(billable, fte, [8], [5])
+    by_semester = forecast.forecast(billable, fte, [8], [5], by_semester=True)
+
+    year_rate = (7 * 80 + 128 + 80) / (9 * 160)
+    assert by_year.rates['Year (Semester) to Date'][0, 0] == pytest.approx(year_rate)
+    assert by_year.predicted_utilization['Year (Semester) to Date'][0, -1] == (
+        pytest.approx((768 + 3 * 160 * year_rate) / 1920))
+
+    semester_rate = (128 + 80) / (2 * 160)
+    predicted = by_semester.predicted_utilization['Year (Semester) to Date'][0]
+    assert by_semester.rates['Year (Semester) to Date'][0, 0] == pytest.approx(semester_rate)
+    assert predicted[6] == pytest.approx(0.5)
+    assert predicted[-1] == pytest.approx((208 + 3 * 160 * semester_rate) / 800)
+
+
+def fiscal_2020():
+    # DATES for April 2019 - March 2020, and the months' FTE
+    days = pd.bdate_range('2019-04-01', '2020-03-31')
+    dates = pd.DataFrame({'Date': days.strftime('%m/%d/%Y')})
+    dates['Remaining'] = (dates.groupby(days.strftime('%Y-%m'))
+                          .cumcount(ascending=False) + 1).astype(str)
+    dates = sheets.prepare_dates(dates)
+    return dates, sheets.build_months(dates)
+
+
+def test_last_day_on_a_weekend():
+    # Saturday, June 15 2019 leaves the 10 working days from Monday the 17th,
+    # so 60 hours in June are 0.75 of the 80 hours to date
+    dates, _ = fiscal_2020()
+    utilization = pd.DataFrame({'Billable': [0.0] * 12, 'FTE': [160.0] * 12},
+                               index=engine.list_months)
+    utilization.loc['Jun', 'Billable'] = 60
+    last_days = pd.Series([pd.Timestamp('2019-06-15')], index=['Ann'])
+
+    for calendar in (dates, engine.Calendar.from_dates(dates)):
+        reports = report.forecast_reports(utilization, last_days, ['Ann'],
+                                          calendar)
+        table = reports['Month to Date'].table
+        assert table.loc['Jun', 'Util to Date'] == pytest.approx(0.75)
+        assert table.loc['Jun', 'Predicted Hours'] == pytest.approx(120)
+
+
+def test_forecast_users():
+    # Ann works 0.75 of April (176 FTE hours), 0.5 of May (184) and 60 hours
+    # of June (160) through Saturday the 15th, 0.75 of the 80 hours to date.
+    # The rest of the year has 1576 FTE hours, 2096 in all
+    dates, months = fiscal_2020()
+    hours = sheets.prepare_hours(pd.DataFrame({
+        'User Name': ['Ann'] * 3,
+        'Entry Date': ['04/01/2019', '05/01/2019', '06/15/2019'],
+        'Activity Name': ['Project A'] * 3,
+        'Hours Worked': ['132', '92', '60'],
+        'Time Off Hrs': ['0'] * 3,
+        'Time Off Type': [''] * 3}))
+    activities = pd.DataFrame({'Activity Name': ['Project A'],
+                               'Classification': ['Billable']})
+    monthly = engine.build_monthly(hours, activities, dates, months)
+    targets = sheets.prepare_targets(pd.DataFrame(
+        {'User Name': ['Ann'],
+         **{month: ['0.7'] for month in engine.list_months[:9]},
+         **{month: [''] for month in engine.list_months[9:]}}))
+
+    summary = report.forecast_users(['Ann'], monthly, dates,
+                                    method='Month to Date',
+                                    provided_utilization=80, targets=targets)
+    row = summary.iloc[0]
+
+    to_date = 132 + 92 + 120
+    rest = 1576
+    year_rate = to_date / 520
+    assert row['Data Valid Through'] == 'Saturday, June 15, 2019'
+    assert row['Utilization to Date'] == pytest.approx(284 / 520)
+    assert row['Predicted Utilization'] == pytest.approx((to_date + 0.75 * rest) / 2096)
+    expected = {
+        'Month to Date': (to_date + 0.75 * rest) / 2096,
+        'Last Month': (to_date + 0.5 * rest) / 2096,
+        'Year (Semester) to Date': (to_date + year_rate * rest) / 2096,
+        # 0.7 planned for the 1056 FTE hours of Jul - Dec, then the year to
+        # date rate for the 520 of Jan - Mar
+        'Planned': (to_date + 0.7 * 1056 + year_rate * 520) / 2096,
+        'Provided Rate': (to_date + 0.8 * rest) / 2096,
+    }
+    for method, utilization in expected.items():
+        assert row[f'Predicted ({method})'] == pytest.approx(utilization), method
@@ -0,0 +1,56 @@
+import pandas as pd
+from openpyxl import Workbook
+
+import read_deltek
+
+
+def write_export(path, rows):
+    # The detail export: a report header, then the column headers on row 21
+    wb = Workbook()
+    ws = wb.active
+    for _ in range(20):
+        ws.append(['Deltek report'])
+    ws.append(['Project', 'Employee', None, 'Date', 'Hours'])
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+def convert(tmp_path, rows, chunksize=2):
+    export = str(tmp_path / 'export.xlsx')
+    crosswalk = str(tmp_path / 'crosswalk.csv')
+    output = str(tmp_path / 'paste_into_google_sheet.csv')
+    write_export(export, rows)
+    pd.DataFrame({'Employee': ['E1', 'E2'],
+                  'User Name': ['Ann', 'Bob']}).to_csv(crosswalk, index=False)
+    with open(output, 'w') as f:
+        f.write('the last export\n')
+
+    n_rows = read_deltek.convert_export(export, output, crosswalk, chunksize)
+    return n_rows, pd.read_csv(output)
+
+
+def test_blanks_filled_down_across_chunks_in_export_order(tmp_path):
+    n_rows, output = convert(tmp_path, [
+        ['Project B', 'E2', None, '2019-06-04', 8],
+        [None, None, None, '2019-06-03', 4],
+        [None, 'E1', None, '2019-06-03', 2],
+        ['Project A', None, None, '2019-06-05', 6],
+        [None, None, None, None, None],
+    ])
+
+    assert n_rows == 4
+    assert list(output.columns) == read_deltek.output_columns
+    assert output['User Name'].tolist() == ['Bob', 'Bob', 'Ann', 'Ann']
+    assert output['Activity Name'].tolist() == ['Project B', 'Project B',
+                                                'Project B', 'Project A']
+    assert output['Entry Date'].tolist() == ['2019-06-04', '2019-06-03',
+                                             '2019-06-03', '2019-06-05']
+
+
+def test_export_without_rows_replaces_the_output(tmp_path):
+    n_rows, output = convert(tmp_path, [])
+
+    assert n_rows == 0
+    assert output.empty
+    assert list(output.columns) == read_deltek.output_columns
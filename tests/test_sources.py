@@ -0,0 +1,57 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import sheets
+import sources
+
+
+def input_frames():
+    # The input worksheets as read: every cell a string
+    return {
+        'activities': pd.DataFrame({
+            'Activity Name': ['Project A', 'Research', 'Vacation'],
+            'Classification': ['Billable', 'R&D', 'Time Off']}),
+        'dates': pd.DataFrame({'Date': ['08/29/2019', '08/30/2019'],
+                               'Remaining': ['2', '1']}),
+        'employees': pd.DataFrame({'User Name': ['Ann']}),
+        'targets': pd.DataFrame({'User Name': ['Ann'],
+                                 **{month: ['0.8'] for month in
+                                    ['Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+                                     'Oct', 'Nov', 'Dec', 'Jan', 'Feb', 'Mar']}}),
+    }
+
+
+def hours_frame():
+    return pd.DataFrame({
+        'User Name': ['Ann', 'Ann', 'Ann'],
+        'Entry Date': ['08/29/2019', '08/29/2019', '08/30/2019'],
+        'Activity Name': ['Project A', 'Research', ''],
+        'Hours Worked': ['4', '4', '0'],
+        'Time Off Hrs': ['0', '0', '8'],
+        'Time Off Type': ['', '', 'Vacation']})
+
+
+def classifications(path):
+    with sqlite3.connect(path) as connection:
+        return dict(connection.execute(
+            'SELECT activity_name, classification FROM entries').fetchall())
+
+
+def test_fresh_database_refuses_hours_without_activities(tmp_path):
+    source = sources.SqliteSource(str(tmp_path / 'utilization.db'))
+    with pytest.raises(ValueError, match='No activities'):
+        source.write_frames({'hours': hours_frame()})
+    with sqlite3.connect(source.path) as connection:
+        assert connection.execute('SELECT COUNT(*) FROM entries').fetchone() == (0,)
+
+
+def test_fresh_database_classifies_hours_written_with_inputs(tmp_path):
+    source = sources.SqliteSource(str(tmp_path / 'utilization.db'))
+    source.write_frames({'hours': hours_frame(), **input_frames()})
+
+    assert classifications(source.path) == {'Project A': 'Billable',
+                                            'Research': 'R&D',
+                                            'Vacation': 'Time Off'}
+    assert set(source.read_inputs()) == set(sheets.input_titles)
@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+import validate
+
+activities = pd.DataFrame({'Activity Name': ['Project A', 'Vacation'],
+                           'Classification': ['Billable', 'Time Off']})
+
+# DATES for fiscal 2020 (April 2019 - March 2020)
+dates = pd.DataFrame({'Date': ['04/01/2019', '03/31/2020'],
+                      'Remaining': ['22', '1']})
+
+good = {'User Name': 'Ann', 'Entry Date': '06/03/2019',
+        'Activity Name': 'Project A', 'Hours Worked': '8',
+        'Time Off Hrs': '0', 'Time Off Type': ''}
+
+
+def report(*rows):
+    # The Replicon report as read: every cell a string
+    return pd.DataFrame([{**good, **row} for row in rows])
+
+
+@pytest.mark.parametrize('row, problem', [
+    ({'User Name': ' '}, 'missing user'),
+    ({'Entry Date': '06/31/2019'}, 'bad date'),
+    ({'Hours Worked': 'eight'}, 'bad hours'),
+    ({'Time Off Hrs': '-2'}, 'bad hours'),
+    ({'Activity Name': 'Project Z'}, 'unknown activity'),
+    ({'Entry Date': '06/03/2018'}, 'outside fiscal years'),
+    ({'Hours Worked': '25'}, 'over daily hours'),
+])
+def test_each_check_quarantines_with_its_label(row, problem):
+    # A good row, and the row under test on another day
+    clean, quarantined, summary = validate.validate_hours(
+        report({}, {'Entry Date': '06/04/2019', **row}), activities, dates)
+
+    assert len(clean) == 1
+    assert quarantined['Problem'].tolist() == [problem]
+    assert summary[problem] == 1
+    assert summary['quarantined'] == 1
+
+
+def test_over_daily_hours_sums_a_day():
+    # 16 + 10 hours on the same day: both rows are set aside
+    clean, quarantined, _ = validate.validate_hours(
+        report({'Hours Worked': '16'},
+               {'Activity Name': '', 'Hours Worked': '0', 'Time Off Hrs': '10',
+                'Time Off Type': 'Vacation'}),
+        activities, dates, max_hours=24)
+
+    assert clean.empty
+    assert quarantined['Problem'].tolist() == ['over daily hours'] * 2
+
+
+def test_duplicate_entries_are_only_counted():
+    clean, quarantined, summary = validate.validate_hours(
+        report({}, {}), activities, dates)
+
+    assert len(clean) == 2
+    assert quarantined.empty
+    assert summary['duplicate entry'] == 1
+
+
+def test_every_failed_check_is_listed():
+    _, quarantined, _ = validate.validate_hours(
+        report({'User Name': '', 'Activity Name': 'Project Z',
+                'Hours Worked': 'x'}),
+        activities, dates)
+
+    assert quarantined['Problem'].tolist() == [
+        'missing user; bad hours; unknown activity']
+
+
+def test_blank_hours_are_zero():
+    clean, quarantined, _ = validate.validate_hours(
+        report({'Time Off Hrs': ' '}), activities, dates)
+
+    assert quarantined.empty
+    assert clean['Time Off Hrs'].tolist() == ['0']
+
+
+def test_quarantine_file_has_the_problem_column(tmp_path):
+    _, quarantined, summary = validate.validate_hours(
+        report({'Activity Name': 'Project Z'}), activities, dates)
+    path = str(tmp_path / 'hours_quarantine.csv')
+    validate.write_quarantine(quarantined, path)
+
+    written = pd.read_csv(path, dtype=str, keep_default_na=False)
+    assert written['Problem'].tolist() == ['unknown activity']
+    assert 'unknown activity: 1' in validate.describe(summary, path)